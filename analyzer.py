@@ -0,0 +1,432 @@
+from __future__ import annotations
+
+import re
+import typing
+import functools
+import dataclasses
+
+import current_rules
+
+VALUED_TOKENS: typing.Final[frozenset[str]] = frozenset(['ID', 'STR', 'INT', 'FLOAT'])
+
+# internal symbols, they can never clash with grammar
+# symbols because neither tokens nor variables contain %
+START: typing.Final[str] = '%start'
+END: typing.Final[str] = '%eof'
+PROBE: typing.Final[str] = '%probe'
+
+# bodies of the parametrized rules, as the happy generator emits them
+PARAMETRIZED_BODIES: typing.Final[dict[str, list[list[str]]]] = {
+    kind: [body for body, _ in alternatives]
+    for kind, alternatives in current_rules.PARAMETRIZED.items()
+}
+
+def is_terminal(symbol: str) -> bool:
+    return symbol.startswith("'") or symbol in VALUED_TOKENS or symbol == END
+
+def parametrized(symbol: str) -> typing.Optional[tuple[str, str]]:
+
+    if match := re.fullmatch(r'(\w+)\((.+)\)', symbol):
+        return match.group(1), match.group(2)
+
+    return None
+
+def instantiate(body: list[str], argument: str) -> list[str]:
+    return [argument if symbol == 'a' else symbol.replace('(a)', f'({argument})') for symbol in body]
+
+def token_name(name: str, regex: str) -> str:
+
+    # same cleaning as the happy token declarations
+    if name in VALUED_TOKENS:
+        return name
+
+    return regex.replace('"', '')
+
+def literal(entry: typing.Any) -> str:
+
+    # keywords are quoted as grammar terminals
+    name = token_name(entry.name, entry.regex)
+    return name if entry.name in VALUED_TOKENS else f"'{name}'"
+
+def reachable_from(seeds: typing.Iterable[str], successors: typing.Callable[[str], typing.Iterable[str]]) -> set[str]:
+
+    reached: set[str] = set()
+    pending = list(seeds)
+    while pending:
+        symbol = pending.pop()
+        if symbol in reached:
+            continue
+        reached.add(symbol)
+        pending.extend(successors(symbol))
+
+    return reached
+
+def known_tokens(tokens: list) -> set[str]:
+    return { literal(entry) for entry in tokens }
+
+@dataclasses.dataclass(frozen=True)
+class Production:
+
+    lhs: str
+    rhs: tuple[str, ...]
+
+    def __str__(self) -> str:
+        return f'{self.lhs} -> {" ".join(self.rhs) or "<empty>"}'
+
+@dataclasses.dataclass(frozen=True, kw_only=True)
+class Grammar:
+
+    # production 0 is the augmented %start -> program
+    productions: tuple[Production, ...]
+    by_lhs: dict[str, list[int]]
+    defined: list[str]
+    duplicated: list[str]
+    undefined: list[str]
+
+    @staticmethod
+    def from_rules(rules: list) -> Grammar:
+
+        productions = [Production(START, (str(rules[0].lhs),))] if rules else []
+        defined: list[str] = []
+        duplicated: list[str] = []
+        for rule in rules:
+            lhs = str(rule.lhs)
+            if lhs in defined:
+                duplicated.append(lhs)
+            defined.append(lhs)
+            for alternative in rule.alternatives():
+                productions.append(Production(lhs, tuple(alternative)))
+
+        # parametrized symbols are instantiated on demand, just like happy does
+        instantiated: set[str] = set(defined)
+        undefined: list[str] = []
+        pending = [symbol for production in productions for symbol in production.rhs]
+        while pending:
+            symbol = pending.pop()
+            if is_terminal(symbol) or symbol in instantiated or symbol in undefined:
+                continue
+            match parametrized(symbol):
+                case (kind, argument) if kind in PARAMETRIZED_BODIES:
+                    instantiated.add(symbol)
+                    for body in PARAMETRIZED_BODIES[kind]:
+                        rhs = tuple(instantiate(body, argument))
+                        productions.append(Production(symbol, rhs))
+                        pending.extend(rhs)
+                case _:
+                    undefined.append(symbol)
+
+        by_lhs: dict[str, list[int]] = {}
+        for index, production in enumerate(productions):
+            by_lhs.setdefault(production.lhs, []).append(index)
+
+        return Grammar(
+            productions=tuple(productions),
+            by_lhs=by_lhs,
+            defined=defined,
+            duplicated=duplicated,
+            undefined=sorted(undefined)
+        )
+
+    @functools.cached_property
+    def terminals(self) -> frozenset[str]:
+        return frozenset(
+            symbol for production in self.productions
+            for symbol in production.rhs if is_terminal(symbol)
+        ) | { END }
+
+    @functools.cached_property
+    def nullable(self) -> frozenset[str]:
+
+        nullable: set[str] = set()
+        changed = True
+        while changed:
+            changed = False
+            for production in self.productions:
+                if production.lhs not in nullable and all(symbol in nullable for symbol in production.rhs):
+                    nullable.add(production.lhs)
+                    changed = True
+
+        return frozenset(nullable)
+
+    @functools.cached_property
+    def first(self) -> dict[str, frozenset[str]]:
+
+        first: dict[str, set[str]] = { lhs: set() for lhs in self.by_lhs }
+        changed = True
+        while changed:
+            changed = False
+            for production in self.productions:
+                before = len(first[production.lhs])
+                first[production.lhs] |= self.first_of_sequence(production.rhs, first)
+                changed |= len(first[production.lhs]) != before
+
+        return { lhs: frozenset(symbols) for lhs, symbols in first.items() }
+
+    def first_of_sequence(self, symbols: typing.Sequence[str], first: typing.Optional[typing.Mapping] = None) -> set[str]:
+
+        first = self.first if first is None else first
+        result: set[str] = set()
+        for symbol in symbols:
+            if is_terminal(symbol):
+                result.add(symbol)
+                return result
+            result |= first.get(symbol, set())
+            if symbol not in self.nullable:
+                return result
+
+        return result
+
+    def nullable_sequence(self, symbols: typing.Sequence[str]) -> bool:
+        return all(not is_terminal(symbol) and symbol in self.nullable for symbol in symbols)
+
+    @functools.cached_property
+    def follow(self) -> dict[str, frozenset[str]]:
+
+        follow: dict[str, set[str]] = { lhs: set() for lhs in self.by_lhs }
+        follow.setdefault(START, set()).add(END)
+        changed = True
+        while changed:
+            changed = False
+            for production in self.productions:
+                for index, symbol in enumerate(production.rhs):
+                    if is_terminal(symbol) or symbol not in follow:
+                        continue
+                    rest = production.rhs[index + 1:]
+                    before = len(follow[symbol])
+                    follow[symbol] |= self.first_of_sequence(rest)
+                    if self.nullable_sequence(rest):
+                        follow[symbol] |= follow[production.lhs]
+                    changed |= len(follow[symbol]) != before
+
+        return { lhs: frozenset(symbols) for lhs, symbols in follow.items() }
+
+    @functools.cached_property
+    def probe_closure(self) -> typing.Callable[[Item], frozenset[tuple[int, int, str]]]:
+
+        @functools.cache
+        def closure(item: Item) -> frozenset[tuple[int, int, str]]:
+            production, dot = item
+            items: set[tuple[int, int, str]] = set()
+            pending = [(production, dot, PROBE)]
+            while pending:
+                current = pending.pop()
+                if current in items:
+                    continue
+                items.add(current)
+                production, dot, lookahead = current
+                rhs = self.productions[production].rhs
+                if dot == len(rhs) or is_terminal(rhs[dot]):
+                    continue
+                rest = rhs[dot + 1:]
+                followers = self.first_of_sequence(rest)
+                if self.nullable_sequence(rest):
+                    followers.add(lookahead)
+                for index in self.by_lhs.get(rhs[dot], []):
+                    pending.extend((index, 0, follower) for follower in followers)
+
+            return frozenset(items)
+
+        return closure
+
+    def reachable(self) -> set[str]:
+        return reachable_from([START], lambda lhs: [
+            symbol
+            for index in self.by_lhs.get(lhs, [])
+            for symbol in self.productions[index].rhs if not is_terminal(symbol)
+        ])
+
+# an lr item: ( production index, dot position )
+Item = tuple[int, int]
+
+@dataclasses.dataclass(frozen=True, kw_only=True)
+class Conflict:
+
+    state: int
+    terminal: str
+    kind: str
+    productions: list[str]
+
+    def __str__(self) -> str:
+        return f'{self.kind} conflict on {self.terminal} in state {self.state}: {" | ".join(self.productions)}'
+
+@dataclasses.dataclass(frozen=True, kw_only=True)
+class Automaton:
+
+    grammar: Grammar
+    kernels: list[frozenset[Item]]
+    transitions: dict[tuple[int, str], int]
+    lookaheads: dict[tuple[int, Item], set[str]]
+
+    @staticmethod
+    def build(grammar: Grammar) -> Automaton:
+
+        kernels, transitions = Automaton.lr0(grammar)
+        lookaheads = Automaton.lalr1(grammar, kernels, transitions)
+        return Automaton(
+            grammar=grammar,
+            kernels=kernels,
+            transitions=transitions,
+            lookaheads=lookaheads
+        )
+
+    @staticmethod
+    def lr0(grammar: Grammar) -> tuple[list[frozenset[Item]], dict[tuple[int, str], int]]:
+
+        def closure(kernel: frozenset[Item]) -> set[Item]:
+            items = set(kernel)
+            pending = list(kernel)
+            while pending:
+                production, dot = pending.pop()
+                rhs = grammar.productions[production].rhs
+                if dot < len(rhs) and not is_terminal(rhs[dot]):
+                    for index in grammar.by_lhs.get(rhs[dot], []):
+                        if (index, 0) not in items:
+                            items.add((index, 0))
+                            pending.append((index, 0))
+            return items
+
+        start = frozenset([(0, 0)])
+        kernels: list[frozenset[Item]] = [start]
+        numbered: dict[frozenset[Item], int] = { start: 0 }
+        transitions: dict[tuple[int, str], int] = {}
+        state = 0
+        while state < len(kernels):
+            successors: dict[str, set[Item]] = {}
+            for production, dot in closure(kernels[state]):
+                rhs = grammar.productions[production].rhs
+                if dot < len(rhs):
+                    successors.setdefault(rhs[dot], set()).add((production, dot + 1))
+
+            for symbol in sorted(successors):
+                kernel = frozenset(successors[symbol])
+                if kernel not in numbered:
+                    numbered[kernel] = len(kernels)
+                    kernels.append(kernel)
+                transitions[(state, symbol)] = numbered[kernel]
+            state += 1
+
+        return kernels, transitions
+
+    @staticmethod
+    def lalr1(grammar: Grammar, kernels: list[frozenset[Item]], transitions: dict[tuple[int, str], int]) -> dict[tuple[int, Item], set[str]]:
+
+        # lookaheads are discovered by closing each kernel item
+        # with a probe symbol: lookaheads other than the probe are
+        # spontaneous, the probe itself marks propagation
+        closure = grammar.probe_closure
+        lookaheads: dict[tuple[int, Item], set[str]] = {
+            (state, item): set() for state, kernel in enumerate(kernels) for item in kernel
+        }
+        lookaheads[(0, (0, 0))].add(END)
+
+        propagation: dict[tuple[int, Item], list[tuple[int, Item]]] = {}
+        for state, kernel in enumerate(kernels):
+            for item in kernel:
+                for production, dot, lookahead in closure(item):
+                    rhs = grammar.productions[production].rhs
+                    if dot == len(rhs):
+                        continue
+                    target = (transitions[(state, rhs[dot])], (production, dot + 1))
+                    if lookahead == PROBE:
+                        propagation.setdefault((state, item), []).append(target)
+                    else:
+                        lookaheads[target].add(lookahead)
+
+        pending = list(lookaheads)
+        while pending:
+            source = pending.pop()
+            for target in propagation.get(source, []):
+                if not lookaheads[source] <= lookaheads[target]:
+                    lookaheads[target] |= lookaheads[source]
+                    pending.append(target)
+
+        return lookaheads
+
+    def actions(self, state: int) -> dict[str, list[tuple[str, int]]]:
+
+        closure = self.grammar.probe_closure
+        actions: dict[str, list[tuple[str, int]]] = {}
+        for item in self.kernels[state]:
+            for production, dot, lookahead in closure(item):
+                rhs = self.grammar.productions[production].rhs
+                if dot < len(rhs):
+                    if is_terminal(rhs[dot]):
+                        action = ('shift', self.transitions[(state, rhs[dot])])
+                        if action not in actions.setdefault(rhs[dot], []):
+                            actions[rhs[dot]].append(action)
+                    continue
+                terminals = self.lookaheads[(state, item)] if lookahead == PROBE else { lookahead }
+                kind = 'accept' if production == 0 else 'reduce'
+                for terminal in terminals:
+                    if (kind, production) not in actions.setdefault(terminal, []):
+                        actions[terminal].append((kind, production))
+
+        return actions
+
+    @functools.cached_property
+    def conflicts(self) -> list[Conflict]:
+
+        conflicts: list[Conflict] = []
+        for state in range(len(self.kernels)):
+            for terminal, actions in sorted(self.actions(state).items()):
+                reductions = [production for kind, production in actions if kind == 'reduce']
+                shifts = [target for kind, target in actions if kind == 'shift']
+                if len(reductions) + len(shifts) < 2:
+                    continue
+                conflicts.append(Conflict(
+                    state=state,
+                    terminal=terminal,
+                    kind='shift/reduce' if shifts else 'reduce/reduce',
+                    productions=[str(self.grammar.productions[production]) for production in reductions]
+                ))
+
+        return conflicts
+
+@dataclasses.dataclass(frozen=True, kw_only=True)
+class Diagnostics:
+
+    duplicated: list[str]
+    undefined: list[str]
+    unknown_tokens: list[str]
+    unreachable: list[str]
+    conflicts: list[Conflict]
+
+    @property
+    def errors(self) -> list[str]:
+        return (
+            [f'variable defined more than once: {lhs}' for lhs in self.duplicated] +
+            [f'variable used but never defined: {symbol}' for symbol in self.undefined] +
+            [f'token missing from the tokens json: {token}' for token in self.unknown_tokens]
+        )
+
+    @property
+    def warnings(self) -> list[str]:
+        return (
+            [f'variable unreachable from the start rule: {lhs}' for lhs in self.unreachable] +
+            [str(conflict) for conflict in self.conflicts]
+        )
+
+    def report(self) -> str:
+        return '\n'.join(self.errors + self.warnings)
+
+def analyze(rules: list, tokens: list) -> Diagnostics:
+
+    grammar = Grammar.from_rules(rules)
+    known = known_tokens(tokens)
+    used = sorted({
+        symbol for production in grammar.productions
+        for symbol in production.rhs if is_terminal(symbol)
+    })
+
+    reachable = grammar.reachable()
+
+    # conflicts are meaningless while some variables are undefined
+    conflicts = [] if grammar.undefined else Automaton.build(grammar).conflicts
+
+    return Diagnostics(
+        duplicated=grammar.duplicated,
+        undefined=grammar.undefined,
+        unknown_tokens=[token for token in used if token not in known],
+        unreachable=[lhs for lhs in dict.fromkeys(grammar.defined) if lhs not in reachable],
+        conflicts=conflicts
+    )
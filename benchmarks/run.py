@@ -0,0 +1,338 @@
+from __future__ import annotations
+
+import sys
+import json
+import time
+import types
+import typing
+import logging
+import pathlib
+import argparse
+import platform
+import tempfile
+import itertools
+import contextlib
+import statistics
+import subprocess
+import dataclasses
+import unittest.mock
+
+import main
+import cache
+import spool
+import harvesting
+
+from benchmarks import standins
+from benchmarks import synthetic
+
+ARGPARSE_PROG_DESC: typing.Final[str] = """
+
+Local benchmarks of the grammar generator and the scoring pipeline
+"""
+
+ARGPARSE_OUTPUT_HELP: typing.Final[str] = """
+Where to store the results ( default: benchmarks/results/<commit>.json )
+"""
+
+ARGPARSE_COMPARE_HELP: typing.Final[str] = """
+Results of an earlier run to compare against
+"""
+
+ARGPARSE_REPEAT_HELP: typing.Final[str] = """
+Number of timed repetitions of every case
+"""
+
+ARGPARSE_FILES_HELP: typing.Final[str] = """
+Number of php files in the synthetic scoring corpus
+"""
+
+ARGPARSE_WORKERS_HELP: typing.Final[str] = """
+Numbers of harvesting workers to score the corpus with
+"""
+
+RESULTS_DIR: typing.Final[pathlib.Path] = pathlib.Path('benchmarks/results')
+
+# grammars are scaled relative to the current RULES
+SCALE_FACTORS: typing.Final[list[int]] = [1, 10, 100]
+
+# number of lines of the native asts given to extract_location
+NATIVE_AST_LINES: typing.Final[list[int]] = [10_000, 100_000, 1_000_000]
+
+# lines of context around an extracted location
+LOCATION_WINDOW: typing.Final[int] = 3
+
+NUM_REPEATS: typing.Final[int] = 5
+NUM_CORPUS_FILES: typing.Final[int] = 200
+CORPUS_LINES_PER_FILE: typing.Final[int] = 40
+FAILURE_PERCENT: typing.Final[int] = 30
+SCORING_WORKERS: typing.Final[list[int]] = [1, 8]
+
+@dataclasses.dataclass(frozen=True, kw_only=True)
+class Argparse:
+
+    tokens_json_filename: pathlib.Path
+    rules_python_filename: pathlib.Path
+    output_filename: typing.Optional[pathlib.Path]
+    compare_filename: typing.Optional[pathlib.Path]
+    repeat: int
+    files: int
+    workers: list[int]
+
+    @staticmethod
+    def run() -> typing.Optional[Argparse]:
+
+        parser = argparse.ArgumentParser(
+            description=ARGPARSE_PROG_DESC
+        )
+
+        parser.add_argument(
+            '--tokens_json',
+            required=False,
+            type=str,
+            default='tokens.php.json',
+            metavar="<tokens>.json",
+            help=main.ARGPARSE_CONTENT_HELP
+        )
+
+        parser.add_argument(
+            '--rules_python',
+            required=False,
+            type=str,
+            default='current_rules.py',
+            metavar="<rules>.py",
+            help=main.ARGPARSE_CONTENT_HELP
+        )
+
+        parser.add_argument(
+            '--output',
+            required=False,
+            type=str,
+            metavar="<results>.json",
+            help=ARGPARSE_OUTPUT_HELP
+        )
+
+        parser.add_argument(
+            '--compare',
+            required=False,
+            type=str,
+            metavar="<baseline>.json",
+            help=ARGPARSE_COMPARE_HELP
+        )
+
+        parser.add_argument(
+            '--repeat',
+            required=False,
+            type=int,
+            default=NUM_REPEATS,
+            metavar="<num_repeats>",
+            help=ARGPARSE_REPEAT_HELP
+        )
+
+        parser.add_argument(
+            '--files',
+            required=False,
+            type=int,
+            default=NUM_CORPUS_FILES,
+            metavar="<num_files>",
+            help=ARGPARSE_FILES_HELP
+        )
+
+        parser.add_argument(
+            '--workers',
+            required=False,
+            type=int,
+            nargs='+',
+            default=SCORING_WORKERS,
+            metavar="<num_workers>",
+            help=ARGPARSE_WORKERS_HELP
+        )
+
+        args = parser.parse_args()
+
+        if not pathlib.Path(args.tokens_json).is_file():
+            logging.info('tokens json file does not exist 😬')
+            return None
+
+        if not pathlib.Path(args.rules_python).is_file():
+            logging.info('rules python file does not exist 😬')
+            return None
+
+        if args.compare and not pathlib.Path(args.compare).is_file():
+            logging.info('baseline results file does not exist 😬')
+            return None
+
+        if args.repeat < 1 or args.files < 1 or any(workers < 1 for workers in args.workers):
+            logging.info('repeats, files and workers must be positive 😬')
+            return None
+
+        return Argparse(
+            tokens_json_filename=pathlib.Path(args.tokens_json),
+            rules_python_filename=pathlib.Path(args.rules_python),
+            output_filename=pathlib.Path(args.output) if args.output else None,
+            compare_filename=pathlib.Path(args.compare) if args.compare else None,
+            repeat=args.repeat,
+            files=args.files,
+            workers=args.workers
+        )
+
+def measure(
+    function: typing.Callable[[], typing.Any],
+    repeat: int,
+    setup: typing.Callable[[], typing.Any] = lambda: None
+) -> dict:
+
+    # the setup of every repetition is not timed
+    samples: list[float] = []
+    for _ in range(repeat):
+        setup()
+        start = time.perf_counter()
+        function()
+        samples.append(time.perf_counter() - start)
+
+    return {
+        'repeat': repeat,
+        'min': min(samples),
+        'median': statistics.median(samples),
+        'mean': statistics.mean(samples),
+        'max': max(samples)
+    }
+
+def bench_generator(rules_module: types.ModuleType, tokens: list, repeat: int) -> dict[str, dict]:
+
+    results: dict[str, dict] = {}
+    for factor in SCALE_FACTORS:
+        scaled_tokens = synthetic.scale_tokens(rules_module, tokens, factor)
+        scaled_rules = synthetic.scale_rules(rules_module, rules_module.RULES, tokens, factor)
+        lexer = rules_module.Lexer(data=scaled_tokens)
+        parser = rules_module.Parser(tokens=scaled_tokens, rules=scaled_rules)
+
+        logging.info('generating with %dx the grammar ( %d rules ) ⏱️', factor, len(scaled_rules))
+        results[f'alexify/{factor}x'] = measure(lexer.alexify_content, repeat)
+        results[f'happify/{factor}x'] = measure(parser.happify_the_content, repeat)
+
+    return results
+
+def bench_extract_location(repeat: int) -> dict[str, dict]:
+
+    # cold lookups build the line index of the dump, warm ones reuse it
+    results: dict[str, dict] = {}
+    for num_lines in NATIVE_AST_LINES:
+        data = synthetic.native_ast(num_lines).encode('utf-8')
+        message = f'lineStart = {num_lines - 1}, lineEnd = {num_lines - 1}, colStart = 5, colEnd = 14'
+        native_ast = spool.NativeAst(key='', data=data)
+
+        def fresh_native_ast() -> None:
+            nonlocal native_ast
+            native_ast = spool.NativeAst(key='', data=data) # pylint: disable=cell-var-from-loop
+
+        def extract() -> None:
+            harvesting.extract_location(message, native_ast, LOCATION_WINDOW) # pylint: disable=cell-var-from-loop
+
+        logging.info('extracting a location out of %d lines ⏱️', num_lines)
+        results[f'extract_location/{num_lines}_lines/cold'] = measure(extract, repeat, fresh_native_ast)
+        results[f'extract_location/{num_lines}_lines/warm'] = measure(extract, repeat)
+
+    return results
+
+def bench_scoring(workdir: pathlib.Path, num_files: int, all_workers: list[int], repeat: int) -> dict[str, dict]:
+
+    corpus = workdir / 'corpus'
+    corpus.mkdir()
+    synthetic.corpus(corpus, num_files, CORPUS_LINES_PER_FILE)
+
+    # a fresh native ast cache per cold repetition, the warm ones reuse
+    # a cache that a first untimed run has filled, all are patched in
+    # and harvesting gets its own cache back once the benchmark is done
+    caches = iter(range(sys.maxsize))
+    patches = contextlib.ExitStack()
+
+    def fresh_cache() -> None:
+        patches.enter_context(unittest.mock.patch.object(harvesting, 'NATIVE_AST_CACHE', cache.DiskCache(
+            directory=workdir / f'native_ast_{next(caches)}',
+            max_bytes=harvesting.NATIVE_AST_CACHE_MAX_BYTES
+        )))
+
+    results: dict[str, dict] = {}
+    try:
+        servers = standins.StandIns.start(FAILURE_PERCENT)
+    except OSError as error:
+        logging.error('cannot start the stand-in parsers, are the real ones running ? ( %s ) 😬', error)
+        return results
+
+    try:
+        for workers, compress in itertools.product(all_workers, [False, True]):
+
+            def score() -> None:
+                harvesting.harvest(harvesting.collect(str(corpus)), workers) # pylint: disable=cell-var-from-loop
+
+            harvesting.NATIVE_PHP_PARSER.compress = compress
+            harvesting.DHSCANNER_PARSER.compress = compress
+            suffix = '_gzip' if compress else ''
+
+            logging.info('scoring %d files with %d workers%s ⏱️', num_files, workers, ' ( gzip )' if compress else '')
+            results[f'score/{workers}_workers/cold{suffix}'] = measure(score, repeat, fresh_cache)
+            score()
+            results[f'score/{workers}_workers/warm{suffix}'] = measure(score, repeat)
+    finally:
+        patches.close()
+        harvesting.NATIVE_PHP_PARSER.compress = False
+        harvesting.DHSCANNER_PARSER.compress = False
+        servers.stop()
+
+    return results
+
+def current_commit() -> str:
+
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], check=True, capture_output=True, text=True).stdout.strip()
+        status = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], check=True, capture_output=True, text=True).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+    return f'{commit}-dirty' if status else commit
+
+def compare(baseline: dict, current: dict) -> None:
+
+    for name, result in current['results'].items():
+        if previous := baseline['results'].get(name):
+            ratio = result['median'] / previous['median'] if previous['median'] else float('inf')
+            logging.info('%-40s %10.4fs -> %10.4fs ( x%.2f )', name, previous['median'], result['median'], ratio)
+        else:
+            logging.info('%-40s %10s -> %10.4fs', name, 'new', result['median'])
+
+def run(args: Argparse) -> None:
+
+    rules_module = main.load_rules_module(args.rules_python_filename)
+    tokens = rules_module.from_tokens_json(args.tokens_json_filename)
+    if tokens is None:
+        return
+
+    commit = current_commit()
+    results: dict[str, dict] = {}
+    results.update(bench_generator(rules_module, tokens, args.repeat))
+    results.update(bench_extract_location(args.repeat))
+    with tempfile.TemporaryDirectory() as workdir:
+        results.update(bench_scoring(pathlib.Path(workdir), args.files, args.workers, args.repeat))
+
+    report = {
+        'commit': commit,
+        'created': time.time(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'results': results
+    }
+
+    output_filename = args.output_filename or RESULTS_DIR / f'{commit}.json'
+    output_filename.parent.mkdir(parents=True, exist_ok=True)
+    with output_filename.open('w', encoding='utf-8') as fl:
+        json.dump(report, fl, indent=4)
+
+    logging.info('stored benchmark results in %s 😊', output_filename)
+    if args.compare_filename:
+        with args.compare_filename.open() as fl:
+            compare(json.load(fl), report)
+
+if __name__ == '__main__':
+
+    if args := Argparse.run():
+        run(args)
@@ -0,0 +1,171 @@
+from __future__ import annotations
+
+import gzip
+import json
+import typing
+import threading
+import email.policy
+import email.parser
+import http.server
+import dataclasses
+
+import cache
+
+# the same ports the helper sends its requests to
+NATIVE_PHP_PARSER_PORT: typing.Final[int] = 5000
+DHSCANNER_PARSER_PORT: typing.Final[int] = 3000
+
+STAND_IN_PHP_PARSER_VERSION: typing.Final[str] = 'stand-in'
+STAND_IN_BLADE_COMPILER_VERSION: typing.Final[str] = 'stand-in'
+
+def native_ast_of(code: str) -> str:
+
+    # one dumped echo statement per source line, shaped like
+    # the output of the NodeDumper of the native php parser
+    nodes: list[str] = []
+    for index, line in enumerate(code.split('\n')):
+        number = index + 1
+        nodes.extend([
+            f'    {index}: Stmt_Echo[{number}:1 - {number}:{len(line)}](',
+            '        exprs: array(',
+            f'            0: Scalar_String[{number}:6 - {number}:{max(6, len(line) - 1)}](',
+            f'                value: {line[6:-2]}',
+            '            )',
+            '        )',
+            '    )'
+        ])
+
+    return 'array(\n' + '\n'.join(nodes) + '\n)\n'
+
+def dhscanner_status_of(filename: str, native_ast: str, failure_percent: int) -> dict:
+
+    # whether a file fails is a pure function of its name,
+    # so every run of the benchmark sees the same failures
+    if int(cache.fingerprint(filename)[:8], 16) % 100 >= failure_percent:
+        return { 'filename': filename, 'stmts': [] }
+
+    line = native_ast.count('\n') // 2 + 1
+    return {
+        'tag': 'FAILED',
+        'message': f'Location {{ filename = "{filename}", lineStart = {line}, lineEnd = {line}, colStart = 5, colEnd = 14 }}',
+        'filename': filename
+    }
+
+def multipart_files(content_type: str, body: bytes) -> list[tuple[str, str, str]]:
+
+    # ( field name, filename, content ) of every uploaded file
+    message = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(
+        f'Content-Type: {content_type}\r\n\r\n'.encode() + body
+    )
+
+    return [
+        (str(part.get_param('name', header='content-disposition')), part.get_filename() or '', part.get_content())
+        for part in message.iter_parts()
+    ]
+
+class Handler(http.server.BaseHTTPRequestHandler):
+
+    # keep alive, exactly like the pooled sessions of the helper expect
+    protocol_version = 'HTTP/1.1'
+    failure_percent: int = 0
+
+    def log_message(self, *args: typing.Any) -> None:
+        pass
+
+    def reply(self, body: str, content_type: str = 'text/plain') -> None:
+
+        # compressed like the real parsers do, when the client asks for it
+        data = body.encode('utf-8')
+        compress = 'gzip' in self.headers.get('Accept-Encoding', '')
+        if compress:
+            data = gzip.compress(data, compresslevel=1)
+
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        if compress:
+            self.send_header('Content-Encoding', 'gzip')
+        self.end_headers()
+        self.wfile.write(data)
+
+    def body(self) -> bytes:
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if self.headers.get('Content-Encoding') == 'gzip':
+            return gzip.decompress(body)
+
+        return body
+
+class NativePhpParserHandler(Handler):
+
+    def do_GET(self) -> None:
+        if self.path == '/csrf_token':
+            self.reply('stand-in-csrf-token')
+        elif self.path == '/php_parser_version':
+            self.reply(STAND_IN_PHP_PARSER_VERSION)
+        elif self.path == '/blade_compiler_version':
+            self.reply(STAND_IN_BLADE_COMPILER_VERSION)
+        elif self.path == '/healthcheck':
+            self.reply(json.dumps({ 'healthy': True }), 'application/json')
+        else:
+            self.send_error(404)
+
+    def do_POST(self) -> None:
+        files = multipart_files(self.headers['Content-Type'], self.body())
+        if self.path == '/to/php/ast':
+            self.reply(native_ast_of(files[0][2]))
+        elif self.path == '/to/php/asts':
+            self.reply(
+                ''.join([json.dumps({ 'index': index, 'ast': native_ast_of(code) }) + '\n' for index, (_, _, code) in enumerate(files)]),
+                'application/x-ndjson'
+            )
+        elif self.path == '/to/php/codes':
+            # templates compile to themselves
+            self.reply(
+                ''.join([json.dumps({ 'index': index, 'code': code }) + '\n' for index, (_, _, code) in enumerate(files)]),
+                'application/x-ndjson'
+            )
+        else:
+            self.send_error(404)
+
+class DhscannerParserHandler(Handler):
+
+    def do_GET(self) -> None:
+        if self.path == '/healthcheck':
+            self.reply(json.dumps({ 'healthy': True }), 'application/json')
+        else:
+            self.send_error(404)
+
+    def do_POST(self) -> None:
+        data = json.loads(self.body())
+        if self.path.startswith('/from/php/to/dhscanner/asts'):
+            statuses = [dhscanner_status_of(source['filename'], source['content'], self.failure_percent) for source in data]
+            self.reply(json.dumps(statuses), 'application/json')
+        elif self.path.startswith('/from/php/to/dhscanner/ast'):
+            status = dhscanner_status_of(data['filename'], data['content'], self.failure_percent)
+            self.reply(json.dumps(status), 'application/json')
+        else:
+            self.send_error(404)
+
+@dataclasses.dataclass(kw_only=True)
+class StandIns:
+
+    servers: list[http.server.ThreadingHTTPServer]
+
+    @staticmethod
+    def start(failure_percent: int) -> StandIns:
+
+        dhscanner = type('Handler', (DhscannerParserHandler,), { 'failure_percent': failure_percent })
+        servers = [
+            http.server.ThreadingHTTPServer(('127.0.0.1', NATIVE_PHP_PARSER_PORT), NativePhpParserHandler),
+            http.server.ThreadingHTTPServer(('127.0.0.1', DHSCANNER_PARSER_PORT), dhscanner)
+        ]
+        for server in servers:
+            server.daemon_threads = True
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+
+        return StandIns(servers=servers)
+
+    def stop(self) -> None:
+        for server in self.servers:
+            server.shutdown()
+            server.server_close()
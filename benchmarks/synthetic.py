@@ -0,0 +1,70 @@
+from __future__ import annotations
+
+import re
+import types
+import random
+import pathlib
+
+def is_keyword(regex: str) -> bool:
+    return re.fullmatch(r'\w+', regex) is not None
+
+def scale_tokens(rules_module: types.ModuleType, tokens: list, factor: int) -> list:
+
+    # every copy adds its own keywords, punctuation
+    # and valued tokens are shared by all the copies
+    scaled = list(tokens)
+    for copy in range(1, factor):
+        scaled.extend([
+            rules_module.NameRegex(name=f'{entry.name}_{copy}', regex=f'{entry.regex}_{copy}')
+            for entry in tokens
+            if is_keyword(entry.regex)
+        ])
+
+    return scaled
+
+def scale_rules(rules_module: types.ModuleType, rules: list, tokens: list, factor: int) -> list:
+
+    # copy k renames every variable and keyword with a _k suffix,
+    # so the copies are disjoint grammars of the same shape
+    keywords = { entry.name for entry in tokens if is_keyword(entry.regex) }
+
+    def rename(element, copy: int):
+        match element:
+            case rules_module.Variable(variable=variable):
+                return rules_module.Variable(f'{variable}_{copy}')
+            case rules_module.Token(token=token) if token in keywords:
+                return rules_module.Token(f'{token}_{copy}')
+            case rules_module.Parametrized(kind=kind, variable=variable):
+                return rules_module.Parametrized(kind, rename(variable, copy))
+        return element
+
+    scaled = list(rules)
+    for copy in range(1, factor):
+        for rule in rules:
+            lhs = rules_module.Lhs(f'{rule.lhs}_{copy}')
+            if isinstance(rule, rules_module.RuleChoice):
+                scaled.append(rules_module.RuleChoice(lhs, [rename(element, copy) for element in rule.content]))
+            else:
+                scaled.append(rules_module.RuleSequence(lhs, [rename(element, copy) for element in rule.derived], rule.action))
+
+    return scaled
+
+def native_ast(num_lines: int) -> str:
+
+    # a dump of the requested length, the failing line is
+    # the last one so extraction pays for the whole input
+    nodes = [
+        f'    {index}: Stmt_Echo[{index + 1}:1 - {index + 1}:20]( exprs: array( 0: Scalar_String( value: line {index} ) ) )'
+        for index in range(num_lines - 2)
+    ]
+
+    return 'array(\n' + '\n'.join(nodes) + '\n)'
+
+def corpus(directory: pathlib.Path, num_files: int, lines_per_file: int, seed: int = 0) -> None:
+
+    # php files of varying length, the same ones for a given seed
+    rng = random.Random(seed)
+    for index in range(num_files):
+        lines = rng.randint(1, 2 * lines_per_file)
+        code = '\n'.join(['<?php'] + [f'echo "file {index} line {line}";' for line in range(lines)])
+        (directory / f'file_{index:05d}.php').write_text(code + '\n', encoding='utf-8')
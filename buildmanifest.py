@@ -0,0 +1,62 @@
+from __future__ import annotations
+
+import os
+import json
+import typing
+import pathlib
+import dataclasses
+
+import cache
+
+BUILD_MANIFEST_FILENAME: typing.Final[str] = 'build_manifest.json'
+
+def read_file(filename: pathlib.Path) -> str:
+    with filename.open(encoding='utf-8') as fl:
+        return fl.read()
+
+def store_if_changed(filename: str, content: str) -> bool:
+
+    # an unchanged file keeps its modification
+    # time, so alex, happy and ghc skip it too
+    try:
+        with open(filename, encoding='utf-8') as fl:
+            if fl.read() == content:
+                return False
+    except OSError:
+        pass
+
+    with open(filename, 'w', encoding='utf-8') as fl:
+        fl.write(content)
+
+    return True
+
+@dataclasses.dataclass(frozen=True, kw_only=True)
+class Manifest:
+
+    # output filename -> fingerprints of its inputs and of its content
+    filename: pathlib.Path
+    entries: dict[str, dict]
+
+    @staticmethod
+    def load(filename: pathlib.Path) -> Manifest:
+        try:
+            with filename.open(encoding='utf-8') as fl:
+                return Manifest(filename=filename, entries=json.load(fl))
+        except (OSError, json.JSONDecodeError):
+            return Manifest(filename=filename, entries={})
+
+    def up_to_date(self, output_filename: str, inputs: str) -> bool:
+
+        # the output is checked as well, in case it was edited or removed by hand
+        entry = self.entries.get(output_filename)
+        if entry is None or entry['inputs'] != inputs or not os.path.isfile(output_filename):
+            return False
+
+        return cache.fingerprint(read_file(pathlib.Path(output_filename))) == entry['output']
+
+    def record(self, output_filename: str, inputs: str, content: str) -> None:
+        self.entries[output_filename] = { 'inputs': inputs, 'output': cache.fingerprint(content) }
+
+    def store(self) -> None:
+        with self.filename.open('w', encoding='utf-8') as fl:
+            json.dump(self.entries, fl, indent=4)
@@ -0,0 +1,183 @@
+from __future__ import annotations
+
+import os
+import mmap
+import time
+import typing
+import hashlib
+import pathlib
+import threading
+import contextlib
+import dataclasses
+
+# after an eviction the cache shrinks below
+# this fraction of its maximal size, so that
+# consecutive insertions do not evict every time
+LOW_WATERMARK: typing.Final[float] = 0.8
+
+def fingerprint(*parts: str) -> str:
+
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part.encode('utf-8'))
+        digest.update(b'\0')
+
+    return digest.hexdigest()
+
+@dataclasses.dataclass(kw_only=True)
+class DiskCache:
+
+    directory: pathlib.Path
+    max_bytes: int
+    ttl: typing.Optional[float] = None
+
+    size: int = dataclasses.field(init=False, default=0)
+    lock: threading.Lock = dataclasses.field(init=False, default_factory=threading.Lock)
+
+    def __post_init__(self) -> None:
+
+        # the directory only appears with the first entry,
+        # so merely importing a module that declares a cache
+        # leaves the working directory alone
+        self.size = sum(size for _, size, _ in self.entries())
+
+    def entries(self) -> list[tuple[pathlib.Path, int, float]]:
+
+        entries: list[tuple[pathlib.Path, int, float]] = []
+        for path in self.directory.glob('*/*'):
+            if path.suffix == '.tmp':
+                continue
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((path, stat.st_size, stat.st_atime))
+
+        return entries
+
+    def path(self, key: str) -> pathlib.Path:
+        return self.directory / key[:2] / key
+
+    def lookup(self, key: str) -> typing.Optional[pathlib.Path]:
+
+        path = self.path(key)
+        now = time.time()
+        try:
+            stat = path.stat()
+            if self.ttl is not None and now - stat.st_mtime > self.ttl:
+                self.remove(path)
+                return None
+
+            # the access time marks the entry as recently used, so
+            # eviction removes it last, the modification time stays
+            # the time of insertion so the ttl is not extended
+            os.utime(path, (now, stat.st_mtime))
+        except FileNotFoundError:
+            return None
+
+        return path
+
+    def get(self, key: str) -> typing.Optional[str]:
+
+        data = self.get_bytes(key)
+        return data.decode('utf-8') if data is not None else None
+
+    def get_bytes(self, key: str) -> typing.Optional[bytes]:
+
+        if path := self.lookup(key):
+            try:
+                return path.read_bytes()
+            except FileNotFoundError:
+                return None
+
+        return None
+
+    @contextlib.contextmanager
+    def mapped(self, key: str) -> typing.Iterator[typing.Optional[mmap.mmap]]:
+
+        # the entry is mapped for the duration of the block only, and
+        # entries are replaced, never rewritten in place, so the mapping
+        # stays valid even if the entry is evicted meanwhile
+        mapped = None
+        if path := self.lookup(key):
+            try:
+                mapped = map_file(path)
+            except FileNotFoundError:
+                pass
+
+        with contextlib.nullcontext() if mapped is None else mapped:
+            yield mapped
+
+    def remove(self, path: pathlib.Path) -> None:
+
+        with self.lock:
+            try:
+                size = path.stat().st_size
+                path.unlink()
+            except FileNotFoundError:
+                return
+            self.size -= size
+
+    def put(self, key: str, content: str) -> None:
+        self.put_bytes(key, content.encode('utf-8'))
+
+    def put_bytes(self, key: str, data: bytes) -> None:
+
+        temporary = self.temporary(key)
+        temporary.write_bytes(data)
+        self.commit(key, temporary)
+
+    def put_stream(self, key: str, chunks: typing.Iterable[bytes]) -> pathlib.Path:
+
+        # the content never has to fit in memory as a whole
+        temporary = self.temporary(key)
+        try:
+            with temporary.open('wb') as fl:
+                for chunk in chunks:
+                    fl.write(chunk)
+        except BaseException:
+            temporary.unlink(missing_ok=True)
+            raise
+
+        self.commit(key, temporary)
+        return self.path(key)
+
+    def temporary(self, key: str) -> pathlib.Path:
+
+        # write aside and rename, so concurrent
+        # readers never observe a partial entry
+        path = self.path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        return path.parent / f'{key}.{threading.get_ident()}.tmp'
+
+    def commit(self, key: str, temporary: pathlib.Path) -> None:
+
+        path = self.path(key)
+        size = temporary.stat().st_size
+        with self.lock:
+            try:
+                previous = path.stat().st_size
+            except FileNotFoundError:
+                previous = 0
+
+            os.replace(temporary, path)
+            self.size += size - previous
+            if self.size > self.max_bytes:
+                self.evict()
+
+    def evict(self) -> None:
+
+        for path, size, _ in sorted(self.entries(), key=lambda entry: entry[2]):
+            if self.size <= self.max_bytes * LOW_WATERMARK:
+                break
+            path.unlink(missing_ok=True)
+            self.size -= size
+
+def map_file(path: pathlib.Path) -> typing.Optional[mmap.mmap]:
+
+    # empty files cannot be mapped, missing ones raise
+    with path.open('rb') as fl:
+        try:
+            return mmap.mmap(fl.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            return None
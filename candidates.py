@@ -0,0 +1,261 @@
+from __future__ import annotations
+
+import types
+import typing
+import logging
+import dataclasses
+import concurrent.futures
+
+import clients
+import metrics
+import analyzer
+import workspace
+import harvesting
+import interpreter
+
+# cabal errors can be very long, only their tail goes back to the llm
+FEEDBACK_ERROR_LIMIT: typing.Final[int] = 4000
+
+def pythonify(rules: list) -> str:
+    return ',\n'.join([rule.pythonify(0) for rule in rules])
+
+def invalid_rule_returned(response: str) -> str:
+    return f'the following response does not contain valid rules:\n\n{response}'
+
+def candidate_failed(response: str, error: Exception) -> str:
+    return f'the following response could not be evaluated:\n\n{response}\n\n{error!r}'
+
+def invalid_parser_generated(rules: list, error: str) -> str:
+    return (
+        f'the suggested rules:\n\n{pythonify(rules)}\n\n' +
+        f'failed to build a parser:\n\n{error[-FEEDBACK_ERROR_LIMIT:]}'
+    )
+
+def grammar_rejected(rules: list, diagnostics: analyzer.Diagnostics) -> str:
+    return (
+        f'the suggested rules:\n\n{pythonify(rules)}\n\n' +
+        f'were rejected by the grammar analysis:\n\n{diagnostics.report()}'
+    )
+
+def no_improvement_was_achieved(evaluation: Evaluation) -> str:
+    return (
+        f'the suggested rules:\n\n{pythonify(evaluation.rules)}\n\n' +
+        f'fixed {evaluation.fixed} failing files, but broke {evaluation.regressed} passing files'
+    )
+
+def improvement_was_achieved(evaluation: Evaluation) -> str:
+    return (
+        f'the suggested rules:\n\n{pythonify(evaluation.rules)}\n\n' +
+        f'were accepted: they fixed {evaluation.fixed} failing files'
+    )
+
+@dataclasses.dataclass(frozen=True, kw_only=True)
+class Evaluation:
+
+    index: int
+    feedback: str
+    rules: list = dataclasses.field(default_factory=list)
+    grammar: list = dataclasses.field(default_factory=list)
+    sources: typing.Optional[tuple[workspace.GeneratedFile, workspace.GeneratedFile]] = None
+    locations: dict[str, typing.Optional[dict]] = dataclasses.field(default_factory=dict)
+    fixed: int = 0
+    regressed: int = 0
+
+    @property
+    def improvement(self) -> int:
+        return self.fixed - self.regressed
+
+def build_candidate(
+    candidate: workspace.Workspace,
+    rules_module: types.ModuleType,
+    tokens: list,
+    grammar: list
+) -> tuple[typing.Optional[tuple[workspace.GeneratedFile, workspace.GeneratedFile]], typing.Optional[str]]:
+
+    with metrics.span('generate'):
+        alex_file = rules_module.Lexer(tokens).build(workspace.LEXER_HASKELL_FILENAME)
+        happy_file = rules_module.Parser(tokens, grammar).build(workspace.PARSER_HASKELL_FILENAME)
+    if alex_file is None or happy_file is None:
+        return None, 'failed to generate the alex and happy files'
+
+    # unchanged files are not rewritten, so a warm workspace
+    # recompiles the parser module only
+    candidate.generate(alex_file, happy_file)
+    with metrics.span('build'):
+        error = candidate.build()
+    if error:
+        return None, error
+
+    return (alex_file, happy_file), None
+
+@metrics.timed('candidate')
+def evaluate_candidate(
+    index: int,
+    response: str,
+    rules_module: types.ModuleType,
+    tokens: list,
+    grammar: list,
+    benchmark: harvesting.Benchmark,
+    baseline_conflicts: int,
+    pool: typing.Optional[workspace.Pool]
+) -> Evaluation:
+
+    suggested = rules_module.Rule.extract(response)
+    if suggested is None:
+        return Evaluation(index=index, feedback=invalid_rule_returned(response))
+
+    merged = rules_module.merge_rules(grammar, suggested)
+
+    # obviously broken grammars never reach happy and cabal
+    with metrics.span('analyze'):
+        diagnostics = analyzer.analyze(merged, tokens)
+    if diagnostics.errors or len(diagnostics.conflicts) > baseline_conflicts:
+        logging.info('candidate %d rejected by the grammar analysis 😬', index)
+        metrics.count('candidates_rejected')
+        return Evaluation(index=index, feedback=grammar_rejected(suggested, diagnostics))
+
+    # without build workspaces the in-process parser skips happy, alex
+    # and cabal altogether, the real parser is only built once accepted
+    if pool is None:
+        interpreted = interpreter.Interpreter.create(merged, tokens)
+        if interpreted is None:
+            reason = 'the grammar has no productions, or uses undefined variables'
+            return Evaluation(index=index, feedback=invalid_parser_generated(suggested, reason))
+
+        with metrics.span('interpret'):
+            locations = benchmark.check_improvement_with_interpreter(interpreted)
+            if benchmark.recheck(locations):
+                locations.update(benchmark.check_improvement_with_interpreter(interpreted, originals=True))
+
+        metrics.count('candidates_scored')
+        return scored_evaluation(index, suggested, merged, None, locations, benchmark)
+
+    with pool.acquire() as candidate:
+        sources, error = build_candidate(candidate, rules_module, tokens, merged)
+        if error:
+            return Evaluation(index=index, feedback=invalid_parser_generated(suggested, error))
+
+        built = score_built_candidate(candidate, benchmark)
+        if built is None:
+            error = 'the generated parser failed to start'
+            return Evaluation(index=index, feedback=invalid_parser_generated(suggested, error))
+
+    metrics.count('candidates_scored')
+    return scored_evaluation(index, suggested, merged, sources, built, benchmark)
+
+def score_built_candidate(candidate: workspace.Workspace, benchmark: harvesting.Benchmark) -> typing.Optional[dict[str, typing.Optional[dict]]]:
+
+    # None when the built parser does not come up
+    with candidate.serve() as healthy:
+        if not healthy:
+            return None
+
+        parser = clients.DhscannerParserClient(
+            replicas=clients.Replicas.create([candidate.url]),
+            path=harvesting.DHSCANNER_PARSER_PATH,
+            batch_path=harvesting.DHSCANNER_PARSER_BATCH_PATH,
+            compress=harvesting.DHSCANNER_PARSER.compress
+        )
+
+        with metrics.span('score'):
+            locations = benchmark.check_improvement_with_new(parser)
+            if benchmark.recheck(locations):
+                locations.update(benchmark.check_improvement_with_new(parser, originals=True))
+
+        return locations
+
+def scored_evaluation(
+    index: int,
+    suggested: list,
+    merged: list,
+    sources: typing.Optional[tuple[workspace.GeneratedFile, workspace.GeneratedFile]],
+    locations: dict[str, typing.Optional[dict]],
+    benchmark: harvesting.Benchmark
+) -> Evaluation:
+
+    evaluation = Evaluation(
+        index=index,
+        feedback='',
+        rules=suggested,
+        grammar=merged,
+        sources=sources,
+        locations=locations,
+        fixed=benchmark.fixed(locations),
+        regressed=benchmark.regressed(locations)
+    )
+
+    logging.info(
+        'candidate %d: fixed %d, broke %d',
+        index,
+        evaluation.fixed,
+        evaluation.regressed
+    )
+
+    if evaluation.improvement <= 0:
+        return dataclasses.replace(evaluation, feedback=no_improvement_was_achieved(evaluation))
+
+    return dataclasses.replace(evaluation, feedback=improvement_was_achieved(evaluation))
+
+def confirm_interpreted_candidate(
+    evaluation: Evaluation,
+    pool: workspace.Pool,
+    rules_module: types.ModuleType,
+    tokens: list,
+    benchmark: harvesting.Benchmark
+) -> Evaluation:
+
+    # the interpreter only approximates alex and happy, so the candidate
+    # it picked is built and scored again by the real parser, whose
+    # locations are the only ones that reach the parsing status
+    with pool.acquire() as candidate:
+        sources, error = build_candidate(candidate, rules_module, tokens, evaluation.grammar)
+        if error:
+            return Evaluation(index=evaluation.index, feedback=invalid_parser_generated(evaluation.rules, error))
+
+        locations = score_built_candidate(candidate, benchmark)
+        if locations is None:
+            error = 'the generated parser failed to start'
+            return Evaluation(index=evaluation.index, feedback=invalid_parser_generated(evaluation.rules, error))
+
+    metrics.count('candidates_confirmed')
+    return scored_evaluation(evaluation.index, evaluation.rules, evaluation.grammar, sources, locations, benchmark)
+
+@metrics.timed('evaluate')
+def evaluate_candidates(
+    responses: list[str],
+    rules_module: types.ModuleType,
+    tokens: list,
+    grammar: list,
+    benchmark: harvesting.Benchmark,
+    pool: typing.Optional[workspace.Pool]
+) -> list[Evaluation]:
+
+    # candidates may not add conflicts on top of the current grammar
+    baseline_conflicts = len(analyzer.analyze(grammar, tokens).conflicts)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(responses)) as executor:
+        futures = [
+            executor.submit(
+                metrics.nested(evaluate_candidate),
+                index,
+                response,
+                rules_module,
+                tokens,
+                grammar,
+                benchmark,
+                baseline_conflicts,
+                pool
+            )
+            for index, response in enumerate(responses)
+        ]
+
+        # one bad answer of the llm is scored as rejected, the rest still count
+        evaluations: list[Evaluation] = []
+        for index, (response, future) in enumerate(zip(responses, futures)):
+            try:
+                evaluations.append(future.result())
+            except Exception as e: # pylint: disable=broad-exception-caught
+                logging.info('candidate %d failed: %r 😬', index, e)
+                metrics.count('candidates_failed')
+                evaluations.append(Evaluation(index=index, feedback=candidate_failed(response, e)))
+
+        return evaluations
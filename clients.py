@@ -0,0 +1,297 @@
+from __future__ import annotations
+
+import time
+import gzip
+import json
+import typing
+import logging
+import itertools
+import threading
+import contextlib
+import dataclasses
+
+import requests
+import requests.adapters
+
+import metrics
+
+POOL_SIZE: typing.Final[int] = 32
+
+# Laravel answers with this ( non standard ) status
+# code when the csrf token of the session has expired
+CSRF_TOKEN_MISMATCH: typing.Final[int] = 419
+
+# native ast dumps repeat node names and positions all
+# over, so even the fastest compression level pays off
+COMPRESSION_LEVEL: typing.Final[int] = 1
+
+# both parsers answer this route, replicas that fail it stay out of rotation
+HEALTHCHECK_PATH: typing.Final[str] = '/healthcheck'
+HEALTHCHECK_TIMEOUT: typing.Final[float] = 2.0
+
+# an ejected replica is checked again after this many seconds
+EJECTION_SECONDS: typing.Final[float] = 5.0
+
+def sent(name: str, response: requests.Response) -> None:
+    metrics.count(f'{name}_requests')
+    body = response.request.body
+    metrics.count(f'{name}_bytes_sent', len(body) if isinstance(body, (bytes, str)) else 0)
+
+def accept_encoding(compress: bool) -> dict[str, str]:
+
+    # requests asks for gzip by default, without
+    # compression the bodies travel as they are
+    return { 'Accept-Encoding': 'gzip' if compress else 'identity' }
+
+def new_session(pool_size: int) -> requests.Session:
+
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(
+        pool_connections=1,
+        pool_maxsize=pool_size
+    )
+
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+@dataclasses.dataclass(kw_only=True)
+class Replica:
+
+    # laravel keeps the session ( and the csrf token in it ) inside a
+    # single replica, and cookies do not tell ports apart, so every
+    # replica has a session of its own
+    url: str
+    session: requests.Session
+    outstanding: int = 0
+    ejected_until: typing.Optional[float] = None
+    token: typing.Optional[str] = None
+
+@dataclasses.dataclass(kw_only=True)
+class Replicas:
+
+    replicas: list[Replica]
+
+    lock: threading.Lock = dataclasses.field(init=False, default_factory=threading.Lock)
+    turns: typing.Iterator[int] = dataclasses.field(init=False, default_factory=itertools.count)
+
+    @staticmethod
+    def create(urls: list[str], pool_size: int = POOL_SIZE) -> Replicas:
+        return Replicas(replicas=[Replica(url=url.rstrip('/'), session=new_session(pool_size)) for url in urls])
+
+    def healthy(self, replica: Replica) -> bool:
+        try:
+            return replica.session.get(f'{replica.url}{HEALTHCHECK_PATH}', timeout=HEALTHCHECK_TIMEOUT).ok
+        except requests.RequestException:
+            return False
+
+    def readmit(self) -> None:
+
+        # every ejected replica whose time is up is checked by
+        # the one thread that noticed it, the rest skip it meanwhile
+        now = time.monotonic()
+        with self.lock:
+            due = [replica for replica in self.replicas if replica.ejected_until is not None and replica.ejected_until <= now]
+            for replica in due:
+                replica.ejected_until = now + EJECTION_SECONDS
+
+        for replica in due:
+            if self.healthy(replica):
+                with self.lock:
+                    replica.ejected_until = None
+                logging.info('replica %s is healthy again 😊', replica.url)
+
+    def pick(self) -> Replica:
+
+        # the healthy replica with the fewest requests in flight, ties
+        # are broken round robin, and when none is healthy all are tried
+        self.readmit()
+        with self.lock:
+            healthy = [replica for replica in self.replicas if replica.ejected_until is None] or self.replicas
+            turn = next(self.turns) % len(healthy)
+            replica = min(healthy[turn:] + healthy[:turn], key=lambda replica: replica.outstanding)
+            replica.outstanding += 1
+            return replica
+
+    def release(self, replica: Replica) -> None:
+        with self.lock:
+            replica.outstanding -= 1
+
+    def eject(self, replica: Replica) -> None:
+
+        with self.lock:
+            if replica.ejected_until is not None:
+                return
+            replica.ejected_until = time.monotonic() + EJECTION_SECONDS
+
+        metrics.count('replicas_ejected')
+        logging.info('ejected replica %s 😬', replica.url)
+
+    @contextlib.contextmanager
+    def request(self, send: typing.Callable[[Replica], requests.Response]) -> typing.Iterator[requests.Response]:
+
+        # a replica that cannot be reached is ejected and the next one is tried,
+        # the one that answers counts as busy until its response is consumed
+        for attempt in range(len(self.replicas)):
+            replica = self.pick()
+            try:
+                response = send(replica)
+            except requests.ConnectionError:
+                self.release(replica)
+                self.eject(replica)
+                if attempt == len(self.replicas) - 1:
+                    raise
+                continue
+            except Exception:
+                self.release(replica)
+                raise
+
+            try:
+                with response:
+                    yield response
+            finally:
+                self.release(replica)
+            return
+
+@dataclasses.dataclass(kw_only=True)
+class NativePhpParserClient:
+
+    replicas: Replicas
+    path: str
+    batch_path: str
+    csrf_token_path: str
+    php_parser_version_path: str
+    blade_batch_path: str
+    blade_compiler_version_path: str
+    compress: bool = False
+
+    version: typing.Optional[str] = dataclasses.field(init=False, default=None)
+    blade_version: typing.Optional[str] = dataclasses.field(init=False, default=None)
+    lock: threading.Lock = dataclasses.field(init=False, default_factory=threading.Lock)
+
+    def csrf_token(self, replica: Replica, expired: typing.Optional[str] = None) -> str:
+
+        # only the first thread that notices an expired
+        # token fetches a new one, the rest reuse its result
+        with self.lock:
+            if replica.token is None or replica.token == expired:
+                response = replica.session.get(f'{replica.url}{self.csrf_token_path}')
+                replica.token = response.text
+                logging.info('fetched csrf token of %s 🔑', replica.url)
+
+            return replica.token
+
+    def get(self, path: str) -> typing.Optional[str]:
+        with self.replicas.request(lambda replica: replica.session.get(f'{replica.url}{path}')) as response:
+            return response.text if response.ok else None
+
+    def php_parser_version(self) -> str:
+
+        # replicas run the same image, so any of them can tell
+        with self.lock:
+            if self.version is None:
+                self.version = self.get(self.php_parser_version_path) or 'unknown'
+                logging.info('native php parser version: %s', self.version)
+
+            return self.version
+
+    def blade_compiler_version(self) -> str:
+
+        with self.lock:
+            if self.blade_version is None:
+                self.blade_version = self.get(self.blade_compiler_version_path) or 'unknown'
+                logging.info('blade compiler version: %s', self.blade_version)
+
+            return self.blade_version
+
+    def send(self, replica: Replica, path: str, files: typing.Any, stream: bool = False) -> requests.Response:
+
+        token = self.csrf_token(replica)
+        response = replica.session.post(
+            f'{replica.url}{path}',
+            files=files,
+            headers={ 'X-CSRF-TOKEN': token, **accept_encoding(self.compress) },
+            stream=stream
+        )
+
+        sent('native_php_parser', response)
+        if response.status_code != CSRF_TOKEN_MISMATCH:
+            return response
+
+        logging.info('csrf token expired 😬')
+        response.close()
+        token = self.csrf_token(replica, expired=token)
+        response = replica.session.post(
+            f'{replica.url}{path}',
+            files=files,
+            headers={ 'X-CSRF-TOKEN': token, **accept_encoding(self.compress) },
+            stream=stream
+        )
+
+        sent('native_php_parser', response)
+        return response
+
+    @contextlib.contextmanager
+    def post(self, files: dict, stream: bool = False) -> typing.Iterator[requests.Response]:
+        with self.replicas.request(lambda replica: self.send(replica, self.path, files, stream)) as response:
+            yield response
+
+    def post_batch(self, sources: list[tuple[str, str]]) -> typing.Iterator[str]:
+
+        files = [('sources[]', source) for source in sources]
+        with self.replicas.request(lambda replica: self.send(replica, self.batch_path, files, stream=True)) as response:
+            response.raise_for_status()
+            for line in response.iter_lines():
+                if line:
+                    yield json.loads(line)['ast']
+
+    def post_blade_batch(self, sources: list[tuple[str, str]]) -> typing.Iterator[typing.Optional[str]]:
+
+        # the php code of every template, None for those that do not compile
+        files = [('sources[]', source) for source in sources]
+        with self.replicas.request(lambda replica: self.send(replica, self.blade_batch_path, files, stream=True)) as response:
+            response.raise_for_status()
+            for line in response.iter_lines():
+                if line:
+                    yield json.loads(line)['code']
+
+@dataclasses.dataclass(kw_only=True)
+class DhscannerParserClient:
+
+    replicas: Replicas
+    path: str
+    batch_path: str
+    compress: bool = False
+
+    def send(self, replica: Replica, path: str, payload: typing.Any, params: typing.Optional[dict] = None) -> requests.Response:
+
+        url = f'{replica.url}{path}'
+        if not self.compress:
+            response = replica.session.post(url, params=params, json=payload, headers=accept_encoding(False))
+        else:
+            response = replica.session.post(
+                url,
+                params=params,
+                data=gzip.compress(json.dumps(payload).encode('utf-8'), compresslevel=COMPRESSION_LEVEL),
+                headers={ 'Content-Type': 'application/json', 'Content-Encoding': 'gzip', **accept_encoding(True) }
+            )
+
+        sent('dhscanner_parser', response)
+        return response
+
+    def post(self, filename: str, content: str) -> dict:
+
+        payload = { 'filename': filename, 'content': content }
+        with self.replicas.request(lambda replica: self.send(replica, self.path, payload, params={ 'filename': filename })) as response:
+            return json.loads(response.text)
+
+    def post_batch(self, sources: list[tuple[str, str]]) -> list[dict]:
+
+        payload = [
+            { 'filename': filename, 'content': content }
+            for filename, content in sources
+        ]
+
+        with self.replicas.request(lambda replica: self.send(replica, self.batch_path, payload)) as response:
+            response.raise_for_status()
+            return json.loads(response.text)
@@ -0,0 +1,110 @@
+from __future__ import annotations
+
+import re
+import typing
+import dataclasses
+
+import analyzer
+import rulestore
+
+# failures shown to the llm in a single prompt
+MAX_PROMPT_FAILURES: typing.Final[int] = 5
+
+# failure clusters sent to the llm concurrently
+MAX_CLUSTERS: typing.Final[int] = 8
+
+# how many levels of field types are added
+# around the ast types the selected actions construct
+AST_EXPANSION_DEPTH: typing.Final[int] = 1
+
+@dataclasses.dataclass(frozen=True, kw_only=True)
+class Slice:
+
+    rules: list
+    tokens: dict
+    ast: str
+    parse_status: dict
+
+def words(content: str) -> set[str]:
+    return set(re.findall(r'[A-Za-z_][A-Za-z_0-9]*|\S', content))
+
+def identifiers(content: str) -> set[str]:
+    return set(re.findall(r'[A-Za-z_][A-Za-z_0-9]*', content))
+
+def failing_identifiers(location: dict) -> set[str]:
+
+    # columns are one-based and inclusive, when the failing
+    # span holds no identifier the whole line is used instead
+    content = location['content']
+    span = content[location['colStart'] - 1:location['colEnd']]
+    return identifiers(span) or identifiers(content)
+
+def seed_variables(store: rulestore.RuleStore, failing: set[str]) -> set[str]:
+
+    seeds = { record.lhs for token in failing for record in store.using_token(token) }
+    if seeds:
+        return seeds
+
+    # the failing node is unknown to the grammar: it will most
+    # likely become a new alternative of one of the choice rules
+    return { record.lhs for record in store.records if record.choice and record.alternatives }
+
+def reachable_rules(rules: list, store: rulestore.RuleStore, seeds: set[str]) -> list:
+
+    reached = analyzer.reachable_from([seed for seed in seeds if seed in store.by_lhs], lambda lhs: [
+        variable for record in store.definitions(lhs)
+        for variable in record.variables() if variable in store.by_lhs
+    ])
+
+    # keep the original order of RULES
+    return [rule for rule in rules if str(rule.lhs) in reached]
+
+def split_data_types(ast: str) -> dict[str, str]:
+
+    data_types: dict[str, str] = {}
+    for block in re.split(r'\n\s*\n', ast):
+        if match := re.match(r'data\s+(\w+)', block.strip()):
+            data_types[match.group(1)] = block.strip()
+
+    return data_types
+
+def constructors_of(block: str) -> set[str]:
+    return set(re.findall(r'^\s*[=|]\s*(\w+)', block, re.MULTILINE))
+
+def select_ast(ast: str, rules: list) -> str:
+
+    constructed = set(re.findall(r'Ast\.(\w+)', '\n'.join([str(rule) for rule in rules])))
+    data_types = split_data_types(ast)
+    selected = [
+        name for name, block in data_types.items()
+        if constructors_of(block) & constructed
+    ]
+
+    for _ in range(AST_EXPANSION_DEPTH):
+        mentioned = set(re.findall(r'(?<![\w.])([A-Z]\w*)', '\n'.join([data_types[name] for name in selected])))
+        selected.extend(name for name in data_types if name in mentioned and name not in selected)
+
+    return '\n\n'.join([block for name, block in data_types.items() if name in selected]) + '\n'
+
+def select(rules: list, tokens: dict, ast: str, parse_status: dict) -> Slice:
+
+    failures = dict(list(parse_status.items())[:MAX_PROMPT_FAILURES])
+    failing: set[str] = set()
+    seen: set[str] = set()
+    for location in failures.values():
+        failing |= failing_identifiers(location)
+        seen |= words(location['content'])
+
+    # tokens of the failing lines are kept even when no rule uses
+    # them yet, since the fix will most likely need exactly those
+    store = rulestore.RuleStore.from_rules(rules)
+    sliced = reachable_rules(rules, store, seed_variables(store, failing))
+    used = { token for rule in sliced for token in rule.tokens() } | seen | analyzer.VALUED_TOKENS
+    keywords = [entry for entry in tokens['keywords'] if analyzer.token_name(entry['name'], entry['regex']) in used]
+
+    return Slice(
+        rules=sliced,
+        tokens={ 'keywords': keywords },
+        ast=select_ast(ast, sliced),
+        parse_status=failures
+    )
@@ -10,6 +10,11 @@ import logging
 import argparse
 import dataclasses
 
+import cache
+import metrics
+import extraction
+import buildmanifest
+
 ARGPARSE_PROG_DESC: typing.Final[str] = """
 Generate Lexer.x from lexer.json and Lexer.in.hs
 """
@@ -22,6 +27,10 @@ ARGPARSE_HASKELL_IN_FILENAME_HELP: typing.Final[str] = """
 Path to output Lexer.in.hs file
 """
 
+ARGPARSE_MANIFEST_HELP: typing.Final[str] = """
+Path to the build manifest, which records the inputs of every output file
+"""
+
 logging.basicConfig(
     level=logging.INFO,
     format="[%(asctime)s] [%(levelname)s]: %(message)s",
@@ -37,6 +46,7 @@ class Argparse:
     parser_haskell_filename: pathlib.Path
     alex_output_filename: str
     happy_output_filename: str
+    manifest_filename: pathlib.Path
 
     @staticmethod
     def run() -> typing.Optional[Argparse]:
@@ -87,6 +97,15 @@ class Argparse:
             help=ARGPARSE_HASKELL_IN_FILENAME_HELP
         )
 
+        parser.add_argument(
+            '--manifest',
+            required=False,
+            type=str,
+            default=buildmanifest.BUILD_MANIFEST_FILENAME,
+            metavar="<manifest>.json",
+            help=ARGPARSE_MANIFEST_HELP
+        )
+
         args = parser.parse_args()
 
         logging.info('received required args 😊')
@@ -112,7 +131,8 @@ class Argparse:
             lexer_haskell_filename=pathlib.Path(args.lexer_haskell),
             parser_haskell_filename=pathlib.Path(args.parser_haskell),
             alex_output_filename=args.alex_output_filename,
-            happy_output_filename=args.happy_output_filename
+            happy_output_filename=args.happy_output_filename,
+            manifest_filename=pathlib.Path(args.manifest)
         )
 
 def extract_parts(haskell_filename: pathlib.Path) -> typing.Optional[tuple[str, str]]:
@@ -268,6 +288,19 @@ GRAMMAR_START: typing.Final[str] = """
 %%
 """
 
+# the one definition of the parametrized rules, the happy text below
+# and the expansions of the analyzer and the interpreter all come
+# from it: ( body, action ) of every alternative, 'a' is the argument
+PARAMETRIZED: typing.Final[dict[str, list[tuple[list[str], str]]]] = {
+    'optional': [([], 'Nothing'), (['a'], 'Just $1')],
+    'listof': [(['a'], '[$1]'), (['a', 'listof(a)'], '$1:$2')],
+    'ornull': [(["'null'"], 'Nothing'), (['a'], 'Just $1')],
+    'possibly_empty_arrayof': [(["'array'", "'('", "')'"], '[]'), (["'array'", "'('", 'listof(a)', "')'"], '$3')]
+}
+
+def happify_parametrized(kind: str, alternatives: list[tuple[list[str], str]]) -> str:
+    return f'{kind}(a): ' + ' | '.join([' '.join(body + [f'{{ {action} }}']) for body, action in alternatives])
+
 PARAMETRIZED_RULES: typing.Final[str] = """
 -- **********************
 -- *                    *
@@ -275,11 +308,13 @@ PARAMETRIZED_RULES: typing.Final[str] = """
 -- *                    *
 -- **********************
 
-optional(a): { Nothing } | a { Just $1 }
-listof(a): a { [$1] } | a listof(a) { $1:$2 }
-ornull(a): 'null' { Nothing } | a { Just $1 }
-possibly_empty_arrayof(a): 'array' '(' ')' { [] } | 'array' '(' listof(a) ')' { $3 }
-"""
+""" + '\n'.join([happify_parametrized(kind, alternatives) for kind, alternatives in PARAMETRIZED.items()]) + '\n'
+
+# tokens used by the bodies of the parametrized rules above
+PARAMETRIZED_TOKENS: typing.Final[dict[str, list[str]]] = {
+    kind: list(dict.fromkeys(symbol.strip("'") for body, _ in alternatives for symbol in body if symbol.startswith("'")))
+    for kind, alternatives in PARAMETRIZED.items()
+}
 
 PROGRAM_STARTS: typing.Final[str] = """
 -- ***********
@@ -343,9 +378,8 @@ class AlexFile:
             self.haskell_epilogue + '}\n'
         )
 
-    def store(self, filename: str) -> None:
-        with open(filename, 'w', encoding='utf-8') as fl:
-            fl.write(str(self))
+    def store(self, filename: str) -> bool:
+        return buildmanifest.store_if_changed(filename, str(self))
 
 @dataclasses.dataclass(frozen=True)
 class Lexer:
@@ -358,7 +392,7 @@ class Lexer:
         if parts is None:
             return None
 
-        if content := self._alexify_content():
+        if content := self.alexify_content():
             return AlexFile(
                 haskell_prologue=parts[0],
                 haskell_epilogue=parts[1],
@@ -367,7 +401,7 @@ class Lexer:
 
         return None
 
-    def _alexify_content(self) -> typing.Optional[str]:
+    def alexify_content(self) -> typing.Optional[str]:
 
         def rulify(name: str) -> str:
             return f'@{name} {{ lex\' AlexRawToken_{name} }}'
@@ -419,9 +453,8 @@ class HappyFile:
             '{\n' + self.haskell_epilogue + '}\n'
         )
 
-    def store(self, filename: str) -> None:
-        with open(filename, 'w', encoding='utf-8') as fl:
-            fl.write(str(self))
+    def store(self, filename: str) -> bool:
+        return buildmanifest.store_if_changed(filename, str(self))
 
 @dataclasses.dataclass(frozen=True)
 class Parser:
@@ -435,7 +468,7 @@ class Parser:
         if parts is None:
             return None
 
-        if content := self._happify_the_content():
+        if content := self.happify_the_content():
             return HappyFile(
                 haskell_prologue=parts[0],
                 haskell_epilogue=parts[1],
@@ -444,7 +477,7 @@ class Parser:
 
         return None
 
-    def _happify_the_content(self) -> typing.Optional[str]:
+    def happify_the_content(self) -> typing.Optional[str]:
 
         def clean(value: str) -> str:
             return value.replace('"', '')
@@ -452,7 +485,7 @@ class Parser:
         def tokenify(name: str, value: str):
             if name != 'SLASH':
                 return f'\'{clean(value)}\' {lbrack} {tag} {raw}_{name} _ {rbrack}'
-            
+
             return f'\'\\\\\' {lbrack} {tag} {raw}_{name} _ {rbrack}'
 
         lbrack = '{'
@@ -485,6 +518,16 @@ class Derived(abc.ABC):
     def __str__(self) -> str:
         ...
 
+    @abc.abstractmethod
+    def pythonify(self, indent: int) -> str:
+        ...
+
+    def variables(self) -> list[str]:
+        return []
+
+    def tokens(self) -> list[str]:
+        return []
+
 @dataclasses.dataclass(frozen=True)
 class Variable(Derived):
 
@@ -494,6 +537,14 @@ class Variable(Derived):
     def __str__(self) -> str:
         return self.variable
 
+    @typing.override
+    def pythonify(self, indent: int) -> str:
+        return f'{" " * indent}Variable({self.variable!r})'
+
+    @typing.override
+    def variables(self) -> list[str]:
+        return [self.variable]
+
 @dataclasses.dataclass(frozen=True)
 class Token(Derived):
 
@@ -504,9 +555,17 @@ class Token(Derived):
         valued_tokens = ['INT', 'ID', 'STR', 'FLOAT']
         if self.token in valued_tokens:
             return self.token
-        
+
         return f'\'{self.token}\''
 
+    @typing.override
+    def pythonify(self, indent: int) -> str:
+        return f'{" " * indent}Token({self.token!r})'
+
+    @typing.override
+    def tokens(self) -> list[str]:
+        return [self.token]
+
 @dataclasses.dataclass(frozen=True)
 class Parametrized(Derived):
 
@@ -517,6 +576,24 @@ class Parametrized(Derived):
     def __str__(self) -> str:
         return f'{self.kind}({self.variable})'
 
+    @typing.override
+    def pythonify(self, indent: int) -> str:
+        pad = ' ' * indent
+        return (
+            f'{pad}Parametrized(\n' +
+            f'{pad}    {self.kind!r},\n' +
+            f'{self.variable.pythonify(indent + 4)}\n' +
+            f'{pad})'
+        )
+
+    @typing.override
+    def variables(self) -> list[str]:
+        return self.variable.variables()
+
+    @typing.override
+    def tokens(self) -> list[str]:
+        return PARAMETRIZED_TOKENS.get(self.kind, [])
+
 @dataclasses.dataclass(frozen=True)
 class Action:
 
@@ -525,6 +602,14 @@ class Action:
     def __str__(self) -> str:
         return self.action
 
+    def pythonify(self, indent: int) -> str:
+        pad = ' ' * indent
+        if '\n' not in self.action:
+            return f'{pad}Action({self.action!r})'
+
+        lines = ',\n'.join([f'{pad}    {line!r}' for line in self.action.split('\n')])
+        return f"{pad}Action('\\n'.join([\n{lines}\n{pad}]))"
+
 @dataclasses.dataclass(frozen=True)
 class Lhs:
 
@@ -533,12 +618,85 @@ class Lhs:
     def __str__(self) -> str:
         return self.lhs
 
+    def pythonify(self, indent: int) -> str:
+        return f'{" " * indent}Lhs({self.lhs!r})'
+
+# the only names a rule suggested by the llm may call,
+# everything else in its response is rejected by extract
+EXTRACTABLE_NAMES: typing.Final[frozenset[str]] = frozenset([
+    'RuleSequence',
+    'RuleChoice',
+    'Parametrized',
+    'Variable',
+    'Action',
+    'Token',
+    'Lhs'
+])
+
+def well_formed(node: typing.Any) -> bool:
+
+    # the llm may put anything in any field, so every
+    # level of the rule is checked before it is used
+    match node:
+        case Variable(variable=str()) | Token(token=str()) | Lhs(lhs=str()) | Action(action=str()):
+            return True
+        case Parametrized(kind=str(), variable=Variable() as variable):
+            return well_formed(variable)
+        case RuleChoice(lhs=Lhs() as lhs, content=list() as content):
+            return well_formed(lhs) and all(isinstance(element, Variable) and well_formed(element) for element in content)
+        case RuleSequence(lhs=Lhs() as lhs, derived=list() as derived, action=Action() as action):
+            return well_formed(lhs) and well_formed(action) and all(isinstance(element, Derived) and well_formed(element) for element in derived)
+
+    return False
+
 @dataclasses.dataclass(frozen=True)
 class Rule(abc.ABC):
+
+    # a field of every concrete rule
+    lhs: Lhs
+
     @abc.abstractmethod
     def __str__(self) -> str:
         ...
 
+    @abc.abstractmethod
+    def pythonify(self, indent: int) -> str:
+        ...
+
+    @abc.abstractmethod
+    def variables(self) -> list[str]:
+        ...
+
+    @abc.abstractmethod
+    def tokens(self) -> list[str]:
+        ...
+
+    @abc.abstractmethod
+    def alternatives(self) -> list[list[str]]:
+        ...
+
+    @staticmethod
+    def extract(response: str) -> typing.Optional[list[Rule]]:
+
+        calls = extraction.calls(response, ['RuleSequence', 'RuleChoice'])
+        if calls is None:
+            return None
+
+        constructors = { name: globals()[name] for name in EXTRACTABLE_NAMES }
+        rules: list[Rule] = []
+        for call in calls:
+            try:
+                rule = extraction.evaluate(call, constructors)
+            except (ValueError, TypeError) as e:
+                logging.info('invalid rule in llm response: %s 😬', e)
+                return None
+            if not well_formed(rule):
+                logging.info('malformed rule in llm response 😬')
+                return None
+            rules.append(rule)
+
+        return rules if rules else None
+
 @dataclasses.dataclass(frozen=True)
 class RuleChoice(Rule):
 
@@ -552,6 +710,29 @@ class RuleChoice(Rule):
         choices = ' |\n'.join([f'{element} {lbrack} $1 {rbrack}' for element in self.content])
         return f'{self.lhs}:\n{choices}\n'
 
+    @typing.override
+    def pythonify(self, indent: int) -> str:
+        pad = ' ' * indent
+        content = ',\n'.join([element.pythonify(indent + 8) for element in self.content])
+        return (
+            f'{pad}RuleChoice(\n' +
+            f'{self.lhs.pythonify(indent + 4)},\n' +
+            f'{pad}    [\n{content}\n{pad}    ],\n' +
+            f'{pad})'
+        )
+
+    @typing.override
+    def variables(self) -> list[str]:
+        return [variable for element in self.content for variable in element.variables()]
+
+    @typing.override
+    def tokens(self) -> list[str]:
+        return []
+
+    @typing.override
+    def alternatives(self) -> list[list[str]]:
+        return [[str(element)] for element in self.content]
+
 @dataclasses.dataclass(frozen=True)
 class RuleSequence(Rule):
 
@@ -566,6 +747,85 @@ class RuleSequence(Rule):
         derived = ' '.join([f'{element}' for element in self.derived])
         return f'{self.lhs}: {derived}\n{lbrack}\n{self.action}\n{rbrack}\n'
 
+    @typing.override
+    def pythonify(self, indent: int) -> str:
+        pad = ' ' * indent
+        derived = ',\n'.join([element.pythonify(indent + 8) for element in self.derived])
+        return (
+            f'{pad}RuleSequence(\n' +
+            f'{self.lhs.pythonify(indent + 4)},\n' +
+            f'{pad}    [\n{derived}\n{pad}    ],\n' +
+            f'{self.action.pythonify(indent + 4)}\n' +
+            f'{pad})'
+        )
+
+    @typing.override
+    def variables(self) -> list[str]:
+        return [variable for element in self.derived for variable in element.variables()]
+
+    @typing.override
+    def tokens(self) -> list[str]:
+        return [token for element in self.derived for token in element.tokens()]
+
+    @typing.override
+    def alternatives(self) -> list[list[str]]:
+        return [[str(element) for element in self.derived]]
+
+def merge_rules(rules: list[Rule], suggested: list[Rule]) -> list[Rule]:
+
+    # a suggested rule replaces the existing rule with the
+    # same lhs, and is appended when its lhs is a new one
+    replacements = { str(rule.lhs): rule for rule in suggested }
+    merged = [replacements.pop(str(rule.lhs), rule) for rule in rules]
+    return merged + list(replacements.values())
+
+def combine_rules(suggestions: list[list[Rule]]) -> list[Rule]:
+
+    # earlier suggestions win conflicts on the same lhs,
+    # except for choices, whose alternatives are united
+    combined: dict[str, Rule] = {}
+    for suggested in suggestions:
+        for rule in suggested:
+            lhs = str(rule.lhs)
+            existing = combined.get(lhs)
+            if existing is None:
+                combined[lhs] = rule
+            elif isinstance(existing, RuleChoice) and isinstance(rule, RuleChoice):
+                content = existing.content + [v for v in rule.content if v not in existing.content]
+                combined[lhs] = RuleChoice(existing.lhs, content)
+
+    return list(combined.values())
+
+RULES_START: typing.Final[str] = 'RULES: list[Rule] = ['
+
+def rules_span(content: str) -> typing.Optional[tuple[int, int]]:
+
+    # from the start of the RULES line up to the closing bracket
+    start = content.find(f'\n{RULES_START}\n') + 1
+    end = content.find('\n]\n', start)
+    if start < 1 or end < 0:
+        return None
+
+    return start, end
+
+def store_rules(rules_python_filename: pathlib.Path, rules: list[Rule]) -> bool:
+
+    with rules_python_filename.open() as fl:
+        content = fl.read()
+
+    span = rules_span(content)
+    if span is None:
+        logging.error('RULES not found in %s', rules_python_filename)
+        return False
+
+    start, end = span
+    body = ',\n'.join([rule.pythonify(4) for rule in rules])
+    content = content[:start] + RULES_START + '\n' + body + content[end:]
+    with rules_python_filename.open('w', encoding='utf-8') as fl:
+        fl.write(content)
+
+    return True
+
 RULES: list[Rule] = [
     RuleSequence(
         Lhs('program'),
@@ -668,14 +928,49 @@ def generate_parser(args: Argparse) -> None:
     if tokens is None:
         return
 
-    lexer = Lexer(tokens)
-    if alex_file := lexer.build(lexer_haskell_filename):
-        alex_file.store(alex_output_filename)
-
-    parser = Parser(tokens, RULES)
-    if happy_file := parser.build(parser_haskell_filename):
-        happy_file.store(happy_output_filename)
+    manifest = buildmanifest.Manifest.load(args.manifest_filename)
+    tokens_digest = cache.fingerprint(*[part for entry in tokens for part in (entry.name, entry.regex)])
+    generator_digest = cache.fingerprint(generator_text())
+
+    # the lexer depends on the tokens only, so
+    # changing the rules never regenerates it
+    lexer_inputs = cache.fingerprint(tokens_digest, generator_digest, buildmanifest.read_file(lexer_haskell_filename))
+    if manifest.up_to_date(alex_output_filename, lexer_inputs):
+        logging.info('%s is up to date 😊', alex_output_filename)
+    elif alex_file := timed_build('generate_lexer', Lexer(tokens), lexer_haskell_filename):
+        changed = alex_file.store(alex_output_filename)
+        manifest.record(alex_output_filename, lexer_inputs, str(alex_file))
+        logging.info('%s %s', alex_output_filename, 'regenerated' if changed else 'unchanged')
+
+    rules_digest = cache.fingerprint(*[str(rule) for rule in RULES])
+    parser_inputs = cache.fingerprint(tokens_digest, rules_digest, generator_digest, buildmanifest.read_file(parser_haskell_filename))
+    if manifest.up_to_date(happy_output_filename, parser_inputs):
+        logging.info('%s is up to date 😊', happy_output_filename)
+    elif happy_file := timed_build('generate_parser', Parser(tokens, RULES), parser_haskell_filename):
+        changed = happy_file.store(happy_output_filename)
+        manifest.record(happy_output_filename, parser_inputs, str(happy_file))
+        logging.info('%s %s', happy_output_filename, 'regenerated' if changed else 'unchanged')
+
+    manifest.store()
+
+def timed_build(name: str, generator: Lexer | Parser, haskell_filename: pathlib.Path) -> typing.Optional[AlexFile | HappyFile]:
+    with metrics.span(name):
+        return generator.build(haskell_filename)
+
+def generator_text() -> str:
+
+    # the templates and the code that renders them shape the
+    # generated files as much as the inputs do, so everything
+    # in this file except the RULES themselves is fingerprinted
+    content = buildmanifest.read_file(pathlib.Path(__file__))
+    if span := rules_span(content):
+        return content[:span[0]] + content[span[1]:]
+
+    return content
 
 if __name__ == "__main__":
     if args := Argparse.run():
-        generate_parser(args)
+        try:
+            generate_parser(args)
+        finally:
+            metrics.store()
@@ -15,11 +15,22 @@ import Data.Time
 import Yesod.Core.Types
 import System.Log.FastLogger
 import Network.Wai.Handler.Warp
+import Data.Maybe ( fromMaybe )
+import Text.Read ( readMaybe )
+import System.Environment ( lookupEnv )
+import Data.IORef ( newIORef, atomicModifyIORef' )
+import Control.Parallel.Strategies ( parMap, rdeepseq )
+
+-- compressed request bodies
+import qualified Data.ByteString
+import qualified Data.ByteString.Lazy
+import qualified Codec.Compression.GZip as GZip
 
 -- Wai stuff
 import qualified Network.Wai
 import qualified Network.Wai.Logger
 import qualified Network.HTTP.Types.Status
+import qualified Network.HTTP.Types.Header
 import qualified Network.Wai.Middleware.RequestLogger as Wai
 
 -- project imports
@@ -50,6 +61,7 @@ data App = App
 
 mkYesod "App" [parseRoutes|
 /from/php/to/dhscanner/ast FromPhpR POST
+/from/php/to/dhscanner/asts FromPhpBatchR POST
 /healthcheck HealthcheckR GET
 |]
 
@@ -63,6 +75,9 @@ getHealthcheckR = returnJson $ Healthy True
 postFromPhpR :: Handler Value
 postFromPhpR = post PhpParser.parseProgram
 
+postFromPhpBatchR :: Handler Value
+postFromPhpBatchR = postBatch PhpParser.parseProgram
+
 postFailed :: String -> String -> Handler Value
 postFailed errorMsg _filename = do
     $logInfoS "(Parser)" (Data.Text.pack errorMsg)
@@ -78,6 +93,17 @@ post parseProgram = do
         Left errorMsg -> postFailed errorMsg (filename src)
         Right ast -> postSucceeded ast
 
+parseStatus :: (FilePath -> String -> Either String Ast.Root) -> SourceFile -> Value
+parseStatus parseProgram src = case parseProgram (filename src) (content src) of
+    Left errorMsg -> toJSON (Error "FAILED" errorMsg (filename src))
+    Right ast -> toJSON ast
+
+-- | one status per file, in request order, evaluated in parallel across capabilities
+postBatch :: (FilePath -> String -> Either String Ast.Root) -> Handler Value
+postBatch parseProgram = do
+    srcs <- requireCheckJsonBody :: Handler [SourceFile]
+    returnJson (parMap rdeepseq (parseStatus parseProgram) srcs)
+
 myLogger :: IO Logger
 myLogger = do
     _loggerSet <- newStdoutLoggerSet defaultBufSize
@@ -105,10 +131,27 @@ formatter zonedDate req status responseSize = toLogStr (logify (unquote (show zo
 loggerSettings :: Wai.RequestLoggerSettings
 loggerSettings = Wai.defaultRequestLoggerSettings { Wai.outputFormat = Wai.CustomOutputFormat formatter }
 
+-- | bodies sent with Content-Encoding: gzip are inflated before they reach the handlers,
+-- responses are already compressed by the gzip middleware of the default middlewares
+gunzipRequests :: Network.Wai.Middleware
+gunzipRequests app req respond = case Prelude.lookup Network.HTTP.Types.Header.hContentEncoding (Network.Wai.requestHeaders req) of
+    Just "gzip" -> do
+        body <- Network.Wai.strictRequestBody req
+        chunks <- newIORef (Data.ByteString.Lazy.toChunks (GZip.decompress body))
+        let nextChunk = atomicModifyIORef' chunks (\remaining -> case remaining of
+                [] -> ([], Data.ByteString.empty)
+                (chunk:rest) -> (rest, chunk))
+        let headers = Prelude.filter ((/= Network.HTTP.Types.Header.hContentEncoding) . fst) (Network.Wai.requestHeaders req)
+        let inflated = req { Network.Wai.requestHeaders = headers, Network.Wai.requestBodyLength = Network.Wai.ChunkedBody }
+        app (Network.Wai.setRequestBodyChunks nextChunk inflated) respond
+    _ -> app req respond
+
+-- | candidate parsers built by the helper listen on their own port
 main :: IO ()
 main = do
+    port <- fromMaybe 3000 . (>>= readMaybe) <$> lookupEnv "PORT"
     waiApp <- toWaiAppPlain App
     myLoggingMiddleware <- Wai.mkRequestLogger loggerSettings
-    let middleware = myLoggingMiddleware . defaultMiddlewaresNoLogging
-    run 3000 $ middleware waiApp
+    let middleware = myLoggingMiddleware . defaultMiddlewaresNoLogging . gunzipRequests
+    run port $ middleware waiApp
 
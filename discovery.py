@@ -0,0 +1,115 @@
+from __future__ import annotations
+
+import os
+import json
+import typing
+import fnmatch
+import pathlib
+import dataclasses
+
+import cache
+import metrics
+
+# dependencies, caches and generated code are never part of the
+# benchmark, the patterns are matched against directory names
+IGNORED: typing.Final[tuple[str, ...]] = (
+    '.*',
+    'vendor',
+    'node_modules',
+    '__pycache__',
+    'cache',
+    'storage',
+    'generated'
+)
+
+MANIFEST_DIR: typing.Final[pathlib.Path] = pathlib.Path('.cache/discovery')
+
+def ignored(name: str, patterns: typing.Iterable[str]) -> bool:
+    return any(fnmatch.fnmatchcase(name, pattern) for pattern in patterns)
+
+def walk(workdir: str, suffix: str = '.php', ignore: typing.Iterable[str] = IGNORED) -> typing.Iterator[os.DirEntry]:
+
+    # depth first, one directory listing at a time, scandir already
+    # knows the type of every entry so no file is stat-ed to find it,
+    # and sorting each listing keeps the order stable across runs,
+    # symlinked directories are not entered so a link loop cannot recurse
+    pending = [workdir]
+    while pending:
+        try:
+            with os.scandir(pending.pop()) as listing:
+                entries = sorted(listing, key=lambda entry: entry.name)
+        except OSError:
+            continue
+
+        directories: list[str] = []
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                if not ignored(entry.name, ignore):
+                    directories.append(entry.path)
+            elif entry.name.endswith(suffix) and entry.is_file():
+                yield entry
+
+        pending.extend(reversed(directories))
+
+def normalized(path: str) -> str:
+    return path.replace('\\', '/')
+
+def files(workdir: str, suffix: str = '.php', ignore: typing.Iterable[str] = IGNORED) -> typing.Iterator[str]:
+    for entry in walk(workdir, suffix, ignore):
+        yield normalized(entry.path)
+
+@dataclasses.dataclass(kw_only=True)
+class Manifest:
+
+    # path -> [ size, mtime in nanoseconds, fingerprint of the content ]
+    filename: pathlib.Path
+    entries: dict[str, list]
+
+    @staticmethod
+    def load(workdir: str) -> Manifest:
+
+        filename = MANIFEST_DIR / f'{cache.fingerprint(os.path.abspath(workdir))}.json'
+        if not filename.is_file():
+            return Manifest(filename=filename, entries={})
+
+        with filename.open() as fl:
+            return Manifest(filename=filename, entries=json.load(fl))
+
+    def fingerprint(self, entry: os.DirEntry) -> tuple[str, bool]:
+
+        # the content is only read again when the size or the mtime moved,
+        # a touched file with the same content does not count as changed
+        path = normalized(entry.path)
+        stat = entry.stat()
+        known = self.entries.get(path)
+        if known and known[0] == stat.st_size and known[1] == stat.st_mtime_ns:
+            return known[2], False
+
+        with open(entry.path, 'r', encoding='utf-8') as fl:
+            source = cache.fingerprint(fl.read())
+
+        self.entries[path] = [stat.st_size, stat.st_mtime_ns, source]
+        return source, known is None or known[2] != source
+
+    def scan(self, workdir: str, suffix: str = '.php', ignore: typing.Iterable[str] = IGNORED) -> typing.Iterator[tuple[str, str, bool]]:
+
+        # ( path, fingerprint, whether it is new or changed ) of every file,
+        # files that are gone are dropped from the manifest once the scan ends
+        seen: set[str] = set()
+        for entry in walk(workdir, suffix, ignore):
+            source, changed = self.fingerprint(entry)
+            seen.add(normalized(entry.path))
+            metrics.count('files_changed' if changed else 'files_unchanged')
+            yield normalized(entry.path), source, changed
+
+        self.entries = { path: self.entries[path] for path in self.entries if path in seen }
+
+    def store(self) -> None:
+
+        # replaced at once, an interrupted run keeps the previous manifest
+        self.filename.parent.mkdir(parents=True, exist_ok=True)
+        temporary = self.filename.with_suffix('.tmp')
+        with temporary.open('w', encoding='utf-8') as fl:
+            json.dump(self.entries, fl)
+
+        os.replace(temporary, self.filename)
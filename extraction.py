@@ -0,0 +1,59 @@
+from __future__ import annotations
+
+import re
+import ast
+import typing
+import logging
+
+def blocks(response: str) -> list[str]:
+
+    # the llm usually wraps its answer in markdown code blocks
+    fenced = re.findall(r'```(\w*)\n(.*?)```', response, re.DOTALL)
+    if not fenced:
+        return [response]
+
+    return [block for language, block in fenced if language in ['', 'py', 'python']]
+
+def calls(response: str, names: list[str]) -> typing.Optional[list[ast.Call]]:
+
+    # calls of the given names, in the order they appear in the response
+    found: list[ast.Call] = []
+    for block in blocks(response):
+        try:
+            tree = ast.parse(block.strip())
+        except SyntaxError:
+            logging.info('llm response is not valid python 😬')
+            return None
+
+        found.extend(sorted(
+            [
+                node for node in ast.walk(tree)
+                if isinstance(node, ast.Call)
+                and isinstance(node.func, ast.Name)
+                and node.func.id in names
+            ],
+            key=lambda call: (call.lineno, call.col_offset)
+        ))
+
+    return found
+
+def evaluate(node: ast.expr, constructors: dict[str, typing.Callable[..., typing.Any]]) -> typing.Any:
+
+    # the response is never executed, only literals and
+    # calls of the given constructors are evaluated
+    match node:
+        case ast.Constant(value=str() as value):
+            return value
+        case ast.List(elts=elements) | ast.Tuple(elts=elements):
+            return [evaluate(element, constructors) for element in elements]
+        case ast.BinOp(left=left, op=ast.Add(), right=right):
+            return evaluate(left, constructors) + evaluate(right, constructors)
+        case ast.Call(func=ast.Attribute(value=ast.Constant(value=str() as separator), attr='join'), args=[arg]):
+            return separator.join(evaluate(arg, constructors))
+        case ast.Call(func=ast.Name(id=name), args=args, keywords=keywords) if name in constructors:
+            return constructors[name](
+                *[evaluate(arg, constructors) for arg in args],
+                **{ keyword.arg: evaluate(keyword.value, constructors) for keyword in keywords if keyword.arg }
+            )
+
+    raise ValueError(f'unsupported expression: {ast.unparse(node)}')
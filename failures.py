@@ -0,0 +1,236 @@
+from __future__ import annotations
+
+import re
+import sys
+import json
+import heapq
+import typing
+import logging
+import pathlib
+import argparse
+import dataclasses
+
+import context
+
+ARGPARSE_PROG_DESC: typing.Final[str] = """
+
+Triage of the failures recorded in the parsing status
+"""
+
+ARGPARSE_PARSING_STATUS_HELP: typing.Final[str] = """
+Path to the parsing status json
+"""
+
+ARGPARSE_BY_HELP: typing.Final[str] = """
+Group failures by the failing token, the native ast node kind or the failing line pattern
+"""
+
+ARGPARSE_TOP_HELP: typing.Final[str] = """
+Number of largest groups to show
+"""
+
+# the keys every failure is indexed by
+KINDS: typing.Final[tuple[str, ...]] = ('token', 'node', 'pattern')
+
+# Stmt_Echo, Expr_Assign, Scalar_String ...
+NODE_KIND: typing.Final[re.Pattern] = re.compile(r'\b([A-Z][a-z]*_\w+)')
+
+TOP_FAILURES: typing.Final[int] = 10
+
+def token_of(location: dict) -> str:
+
+    # identical to the key failures were always clustered by
+    return ' '.join(sorted(context.failing_identifiers(location))) or location['content'].strip()
+
+def node_of(location: dict) -> str:
+    if match := NODE_KIND.search(location['content']):
+        return match.group(1)
+
+    return location['content'].strip()
+
+def pattern_of(location: dict) -> str:
+
+    # positions and numbers differ between otherwise identical lines
+    return re.sub(r'\s+', ' ', re.sub(r'\d+', 'N', location['content'])).strip()
+
+@dataclasses.dataclass(frozen=True, slots=True)
+class Failure:
+
+    location: dict
+    token: str
+    node: str
+    pattern: str
+
+    @staticmethod
+    def create(location: dict) -> Failure:
+        return Failure(
+            location=location,
+            token=token_of(location),
+            node=node_of(location),
+            pattern=pattern_of(location)
+        )
+
+    def key(self, kind: str) -> str:
+        return getattr(self, kind)
+
+@dataclasses.dataclass(kw_only=True)
+class FailureIndex:
+
+    # failing files in the order of the parsing status, and per kind
+    # of key the files of every key, as insertion ordered sets
+    failures: dict[str, Failure] = dataclasses.field(default_factory=dict)
+    by: dict[str, dict[str, dict[str, None]]] = dataclasses.field(default_factory=lambda: { kind: {} for kind in KINDS })
+
+    @staticmethod
+    def create(parse_status: dict) -> FailureIndex:
+
+        index = FailureIndex()
+        for filename, location in parse_status.items():
+            index.add(filename, location)
+
+        return index
+
+    def add(self, filename: str, location: dict) -> None:
+
+        # a re-scored file keeps its place in the parsing status
+        self.remove(filename, keep_order=True)
+        failure = Failure.create(location)
+        self.failures[filename] = failure
+        for kind in KINDS:
+            self.by[kind].setdefault(failure.key(kind), {})[filename] = None
+
+    def remove(self, filename: str, keep_order: bool = False) -> None:
+
+        failure = self.failures.get(filename)
+        if failure is None:
+            return
+
+        if not keep_order:
+            del self.failures[filename]
+
+        for kind in KINDS:
+            files = self.by[kind][failure.key(kind)]
+            del files[filename]
+            if not files:
+                del self.by[kind][failure.key(kind)]
+
+    def update(self, locations: dict[str, typing.Optional[dict]]) -> None:
+
+        # fixed files leave the index, failing ones are ( re ) indexed
+        for filename, location in locations.items():
+            if location is None:
+                self.remove(filename)
+            else:
+                self.add(filename, location)
+
+    def __len__(self) -> int:
+        return len(self.failures)
+
+    def __contains__(self, filename: str) -> bool:
+        return filename in self.failures
+
+    def count(self, kind: str, key: str) -> int:
+        return len(self.by[kind].get(key, {}))
+
+    def files(self, kind: str, key: str) -> list[str]:
+        return list(self.by[kind].get(key, {}))
+
+    def top(self, kind: str, n: int) -> list[tuple[str, int]]:
+
+        # ties keep the order in which the keys first failed
+        largest = heapq.nlargest(n, self.by[kind].items(), key=lambda item: len(item[1]))
+        return [(key, len(files)) for key, files in largest]
+
+    def clusters(self, kind: str, n: int) -> list[dict]:
+
+        # failures on the same key are most likely fixed by the same rule
+        return [
+            { filename: self.failures[filename].location for filename in self.by[kind][key] }
+            for key, _ in self.top(kind, n)
+        ]
+
+    def prioritized(self, kind: str) -> dict:
+
+        # failures of the key that blocks the most files come first
+        return {
+            filename: location
+            for cluster in self.clusters(kind, len(self.by[kind]))
+            for filename, location in cluster.items()
+        }
+
+    def locations(self) -> dict:
+        return { filename: failure.location for filename, failure in self.failures.items() }
+
+    def store_json(self, filename: pathlib.Path) -> None:
+        with filename.open('w', encoding='utf-8') as fl:
+            json.dump(self.locations(), fl, indent=4)
+
+@dataclasses.dataclass(frozen=True, kw_only=True)
+class Argparse:
+
+    parsing_status_json_filename: pathlib.Path
+    by: str
+    top: int
+
+    @staticmethod
+    def run() -> typing.Optional[Argparse]:
+
+        parser = argparse.ArgumentParser(
+            description=ARGPARSE_PROG_DESC
+        )
+
+        parser.add_argument(
+            '--parsing_status',
+            required=True,
+            type=str,
+            metavar="<parse_status>.json",
+            help=ARGPARSE_PARSING_STATUS_HELP
+        )
+
+        parser.add_argument(
+            '--by',
+            required=False,
+            type=str,
+            choices=KINDS,
+            default='node',
+            help=ARGPARSE_BY_HELP
+        )
+
+        parser.add_argument(
+            '--top',
+            required=False,
+            type=int,
+            default=TOP_FAILURES,
+            metavar="<num_groups>",
+            help=ARGPARSE_TOP_HELP
+        )
+
+        args = parser.parse_args()
+
+        if not pathlib.Path(args.parsing_status).is_file():
+            logging.info('parsing status file does not exist 😬')
+            return None
+
+        return Argparse(
+            parsing_status_json_filename=pathlib.Path(args.parsing_status),
+            by=args.by,
+            top=args.top
+        )
+
+def report(index: FailureIndex, kind: str, n: int) -> None:
+
+    logging.info('%d failing files', len(index))
+    for key, count in index.top(kind, n):
+        logging.info('%6d  %s', count, key)
+
+if __name__ == '__main__':
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format="[%(asctime)s] [%(levelname)s]: %(message)s",
+        datefmt="%d/%m/%Y ( %H:%M:%S )",
+        stream=sys.stdout
+    )
+
+    if args := Argparse.run():
+        report(FailureIndex.create(json.loads(args.parsing_status_json_filename.read_text(encoding='utf-8'))), args.by, args.top)
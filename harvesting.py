@@ -0,0 +1,624 @@
+from __future__ import annotations
+
+import os
+import re
+import math
+import json
+import random
+import typing
+import pathlib
+import logging
+import functools
+import itertools
+import contextlib
+import dataclasses
+import concurrent.futures
+
+import requests
+
+import cache
+import spool
+import stream
+import clients
+import metrics
+import failures
+import discovery
+import interpreter
+
+# number of previously passing files that are
+# re-scored after a grammar change, to catch regressions
+REGRESSION_SAMPLE_SIZE: typing.Final[int] = 50
+
+# by default a failure location holds the failing line alone
+LOCATION_WINDOW: typing.Final[int] = 0
+
+BENCHMARK_DIR: typing.Final[str] = 'benchmark/single'
+
+@metrics.timed('collect')
+def collect(workdir: str) -> list[str]:
+
+    files = list(discovery.files(workdir))
+    metrics.count('files_collected', len(files))
+    return files
+
+NATIVE_PHP_PARSER_REPLICAS: typing.Final[list[str]] = ['http://127.0.0.1:5000']
+DHSCANNER_PARSER_REPLICAS: typing.Final[list[str]] = ['http://127.0.0.1:3000']
+
+NATIVE_PHP_PARSER_PATH: typing.Final[str] = '/to/php/ast'
+NATIVE_PHP_PARSER_BATCH_PATH: typing.Final[str] = '/to/php/asts'
+DHSCANNER_PARSER_PATH: typing.Final[str] = '/from/php/to/dhscanner/ast'
+DHSCANNER_PARSER_BATCH_PATH: typing.Final[str] = '/from/php/to/dhscanner/asts'
+CSRF_TOKEN_PATH: typing.Final[str] = '/csrf_token'
+PHP_PARSER_VERSION_PATH: typing.Final[str] = '/php_parser_version'
+BLADE_BATCH_PATH: typing.Final[str] = '/to/php/codes'
+BLADE_COMPILER_VERSION_PATH: typing.Final[str] = '/blade_compiler_version'
+
+# long lived clients: connections are kept alive
+# and the csrf token is fetched once per session,
+# main() swaps in the replicas given on the command line
+NATIVE_PHP_PARSER: typing.Final[clients.NativePhpParserClient] = clients.NativePhpParserClient(
+    replicas=clients.Replicas.create(NATIVE_PHP_PARSER_REPLICAS),
+    path=NATIVE_PHP_PARSER_PATH,
+    batch_path=NATIVE_PHP_PARSER_BATCH_PATH,
+    csrf_token_path=CSRF_TOKEN_PATH,
+    php_parser_version_path=PHP_PARSER_VERSION_PATH,
+    blade_batch_path=BLADE_BATCH_PATH,
+    blade_compiler_version_path=BLADE_COMPILER_VERSION_PATH
+)
+
+DHSCANNER_PARSER: typing.Final[clients.DhscannerParserClient] = clients.DhscannerParserClient(
+    replicas=clients.Replicas.create(DHSCANNER_PARSER_REPLICAS),
+    path=DHSCANNER_PARSER_PATH,
+    batch_path=DHSCANNER_PARSER_BATCH_PATH
+)
+
+# must not exceed max_file_uploads of the native php parser
+NATIVE_AST_BATCH_SIZE: typing.Final[int] = 500
+
+# the dhscanner parser rejects bodies above 80MB ( maximumContentLength ),
+# and since single dumps reach tens of MB, batches are capped by the size
+# of their dumps ( json escaping adds to it ) as well as by their count
+DHSCANNER_BATCH_SIZE: typing.Final[int] = 100
+DHSCANNER_BATCH_BYTES: typing.Final[int] = 32 * 1024 * 1024
+
+REQUEST_ENTITY_TOO_LARGE: typing.Final[int] = 413
+
+NATIVE_AST_CACHE_DIR: typing.Final[pathlib.Path] = pathlib.Path('.cache/native_ast')
+NATIVE_AST_CACHE_MAX_BYTES: typing.Final[int] = 2 * 1024 * 1024 * 1024
+
+# native asts only change when the php file or the
+# php-parser version change, so they are kept across runs
+NATIVE_AST_CACHE: typing.Final[cache.DiskCache] = cache.DiskCache(
+    directory=NATIVE_AST_CACHE_DIR,
+    max_bytes=NATIVE_AST_CACHE_MAX_BYTES
+)
+
+BLADE_CACHE_DIR: typing.Final[pathlib.Path] = pathlib.Path('.cache/blade')
+BLADE_CACHE_MAX_BYTES: typing.Final[int] = 256 * 1024 * 1024
+
+# compiled templates only change when the template or
+# the laravel version change, so they are kept across runs
+BLADE_CACHE: typing.Final[cache.DiskCache] = cache.DiskCache(
+    directory=BLADE_CACHE_DIR,
+    max_bytes=BLADE_CACHE_MAX_BYTES
+)
+
+TOKEN_STREAM_CACHE_DIR: typing.Final[pathlib.Path] = pathlib.Path('.cache/token_streams')
+TOKEN_STREAM_CACHE_MAX_BYTES: typing.Final[int] = 2 * 1024 * 1024 * 1024
+
+# token streams only change when the native ast or the tokens json
+# change, grammar experiments read them without lexing again
+TOKEN_STREAM_CACHE: typing.Final[cache.DiskCache] = cache.DiskCache(
+    directory=TOKEN_STREAM_CACHE_DIR,
+    max_bytes=TOKEN_STREAM_CACHE_MAX_BYTES
+)
+
+@contextlib.contextmanager
+def token_stream(scanner: interpreter.Scanner, native_ast: spool.NativeAst) -> typing.Iterator[stream.TokenStream]:
+
+    # a cached stream is read zero-copy out of its mapped entry,
+    # which stays mapped only while the block uses the stream
+    key = cache.fingerprint(scanner.signature, native_ast.key)
+    with TOKEN_STREAM_CACHE.mapped(key) as mapped:
+        if mapped is not None and (tokens := stream.TokenStream.from_buffer(mapped)):
+            try:
+                yield tokens
+            finally:
+                tokens.release()
+            return
+
+    tokens = scanner.scan(native_ast.text())
+    TOKEN_STREAM_CACHE.put_bytes(key, tokens.to_bytes())
+    yield tokens
+
+def read_single_file(filename: str):
+
+    with open(filename, 'r', encoding='utf-8') as fl:
+        code = fl.read()
+
+    return { 'source': (filename, code) }
+
+def native_ast_cache_key(code: str) -> str:
+    return cache.fingerprint(code, NATIVE_PHP_PARSER.php_parser_version())
+
+def refetch_native_ast(filename: str, code: str, key: str) -> pathlib.Path:
+
+    # a dump evicted while still in use is parsed
+    # again, it parsed fine the first time around
+    logging.info('native ast of %s was evicted, fetching it again 😬', filename)
+    metrics.count('native_ast_refetched')
+    with NATIVE_PHP_PARSER.post({ 'source': (filename, code) }, stream=True) as response:
+        response.raise_for_status()
+        return NATIVE_AST_CACHE.put_stream(key, response.iter_content(spool.CHUNK_SIZE))
+
+def cached_native_ast(filename: str, code: str, key: str) -> typing.Optional[spool.NativeAst]:
+
+    # cached dumps are mapped while they are read, never read as a whole
+    if path := NATIVE_AST_CACHE.lookup(key):
+        return spool.NativeAst(key=key, path=path, fetch=functools.partial(refetch_native_ast, filename, code, key))
+
+    return None
+
+BLADE_SUFFIX: typing.Final[str] = '.blade.php'
+
+# what the native php parser answers for code it cannot parse
+NATIVE_PARSE_ERROR: typing.Final[str] = 'ERROR'
+
+def blade_cache_key(template: str) -> str:
+    return cache.fingerprint(template, NATIVE_PHP_PARSER.blade_compiler_version())
+
+@metrics.timed('read_sources')
+def read_sources(filenames: list[str]) -> dict[str, typing.Optional[str]]:
+
+    # the php code of every file, blade templates are compiled
+    # in batches first, None stands for those that do not compile
+    sources: dict[str, typing.Optional[str]] = {}
+    missing: list[tuple[str, str, str]] = []
+    for filename in filenames:
+        _, code = read_single_file(filename)['source']
+        if not filename.endswith(BLADE_SUFFIX):
+            sources[filename] = code
+            continue
+
+        key = blade_cache_key(code)
+        if (compiled := BLADE_CACHE.get(key)) is not None:
+            sources[filename] = compiled
+        else:
+            missing.append((filename, code, key))
+
+    metrics.count('blade_cache_misses', len(missing))
+
+    for start in range(0, len(missing), NATIVE_AST_BATCH_SIZE):
+        batch = missing[start:start + NATIVE_AST_BATCH_SIZE]
+        templates = [(filename, code) for filename, code, _ in batch]
+        for (filename, _, key), compiled in zip(batch, NATIVE_PHP_PARSER.post_blade_batch(templates)):
+            if compiled is not None:
+                BLADE_CACHE.put(key, compiled)
+            sources[filename] = compiled
+
+    # templates missing from a truncated response count as not compiling
+    return { filename: sources.get(filename) for filename in filenames }
+
+def get_native_ast(filename: str) -> spool.NativeAst:
+
+    code = read_sources([filename])[filename]
+    if code is None:
+        return spool.NativeAst.from_text(NATIVE_PARSE_ERROR)
+
+    key = native_ast_cache_key(code)
+    if native_ast := cached_native_ast(filename, code, key):
+        return native_ast
+
+    # the dump is streamed straight into the cache
+    with NATIVE_PHP_PARSER.post({ 'source': (filename, code) }, stream=True) as response:
+        if not response.ok:
+            return spool.NativeAst.from_text(response.text)
+
+        path = NATIVE_AST_CACHE.put_stream(key, response.iter_content(spool.CHUNK_SIZE))
+
+    return spool.NativeAst(key=key, path=path, fetch=functools.partial(refetch_native_ast, filename, code, key))
+
+@metrics.timed('native_ast')
+def get_native_asts(filenames: list[str]) -> list[tuple[str, spool.NativeAst]]:
+
+    native_asts: dict[str, spool.NativeAst] = {}
+    missing: list[tuple[str, str, str]] = []
+    for filename, code in read_sources(filenames).items():
+        if code is None:
+            native_asts[filename] = spool.NativeAst.from_text(NATIVE_PARSE_ERROR)
+            continue
+
+        key = native_ast_cache_key(code)
+        if native_ast := cached_native_ast(filename, code, key):
+            native_asts[filename] = native_ast
+        else:
+            missing.append((filename, code, key))
+
+    metrics.count('native_ast_cache_hits', len(native_asts))
+    metrics.count('native_ast_cache_misses', len(missing))
+
+    for start in range(0, len(missing), NATIVE_AST_BATCH_SIZE):
+        batch = missing[start:start + NATIVE_AST_BATCH_SIZE]
+        sources = [(filename, code) for filename, code, _ in batch]
+        for (filename, code, key), dump in zip(batch, NATIVE_PHP_PARSER.post_batch(sources)):
+            NATIVE_AST_CACHE.put(key, dump)
+            native_asts[filename] = cached_native_ast(filename, code, key) or spool.NativeAst.from_text(dump)
+
+    # a truncated batch response falls back to single file requests
+    return [
+        (filename, native_asts[filename] if filename in native_asts else get_native_ast(filename))
+        for filename in filenames
+    ]
+
+def get_dhscanner_status_for(filename: str, native_ast: spool.NativeAst) -> dict:
+
+    status = DHSCANNER_PARSER.post(filename, native_ast.text())
+    return { 'filename': filename, 'status': status }
+
+def dhscanner_batches(native_asts: list[tuple[str, spool.NativeAst]]) -> typing.Iterator[list[tuple[str, spool.NativeAst]]]:
+
+    batch: list[tuple[str, spool.NativeAst]] = []
+    size = 0
+    for filename, native_ast in native_asts:
+        if batch and (len(batch) == DHSCANNER_BATCH_SIZE or size + len(native_ast) > DHSCANNER_BATCH_BYTES):
+            yield batch
+            batch, size = [], 0
+
+        batch.append((filename, native_ast))
+        size += len(native_ast)
+
+    if batch:
+        yield batch
+
+def post_dhscanner_batch(batch: list[tuple[str, spool.NativeAst]], parser: clients.DhscannerParserClient) -> list[dict]:
+
+    # only the dumps of a single batch are in memory at once
+    try:
+        return parser.post_batch([(filename, native_ast.text()) for filename, native_ast in batch])
+    except requests.HTTPError as error:
+        if error.response is None or error.response.status_code != REQUEST_ENTITY_TOO_LARGE:
+            raise
+
+    # a batch that is still too large is split in halves, a single dump
+    # that is too large on its own cannot be parsed and stays failing
+    if len(batch) == 1:
+        logging.info('%s is too large for the dhscanner parser 😬', batch[0][0])
+        metrics.count('files_too_large')
+        return [{ 'tag': 'FAILED', 'too_large': True }]
+
+    metrics.count('dhscanner_batches_split')
+    half = len(batch) // 2
+    return post_dhscanner_batch(batch[:half], parser) + post_dhscanner_batch(batch[half:], parser)
+
+@metrics.timed('dhscanner')
+def get_dhscanner_statuses_for(
+    native_asts: list[tuple[str, spool.NativeAst]],
+    parser: clients.DhscannerParserClient = DHSCANNER_PARSER
+) -> list[dict]:
+
+    statuses: list[dict] = []
+    for batch in dhscanner_batches(native_asts):
+        for (filename, _), status in zip(batch, post_dhscanner_batch(batch, parser)):
+            statuses.append({ 'filename': filename, 'status': status })
+
+    metrics.count('files_parsed', len(statuses))
+    return statuses
+
+def extract_location(message: str, native_ast: spool.NativeAst, window: int = LOCATION_WINDOW) -> typing.Optional[dict]:
+
+    pattern = (
+        r'lineStart = (\d+), '
+        r'lineEnd = (\d+), '
+        r'colStart = (\d+), '
+        r'colEnd = (\d+)'
+    )
+
+    match = re.search(pattern, message)
+
+    # print(match)
+    # print(message)
+
+    if match:
+        line_start, line_end, col_start, col_end = match.groups()
+
+        # only the lines around the failing one are read
+        return native_ast.location(int(line_start), int(col_start), int(col_end), window)
+
+    return None
+
+def locate_failures(
+    native_asts: list[tuple[str, spool.NativeAst]],
+    parser: clients.DhscannerParserClient = DHSCANNER_PARSER,
+    window: int = LOCATION_WINDOW
+) -> list[tuple[str, typing.Optional[dict]]]:
+
+    locations: list[tuple[str, typing.Optional[dict]]] = []
+    for (filename, native_ast), parse_status in zip(native_asts, get_dhscanner_statuses_for(native_asts, parser)):
+        if parse_status['status'].get('too_large'):
+            # never counted as fixed, it fails where it begins
+            locations.append((filename, native_ast.location(1, 1, 1, window)))
+            continue
+
+        message = parse_status['status'].get('message', '')
+        locations.append((filename, extract_location(message, native_ast, window)))
+
+    return locations
+
+# batches of a streamed discovery, parsing starts before the walk ends
+STREAMED_BATCH_SIZE: typing.Final[int] = 50
+
+def batches(filenames: typing.Iterable[str], size: int) -> typing.Iterator[list[str]]:
+
+    batch: list[str] = []
+    for filename in filenames:
+        batch.append(filename)
+        if len(batch) == size:
+            yield batch
+            batch = []
+
+    if batch:
+        yield batch
+
+def harvest_sequentially(filenames: typing.Iterable[str]) -> dict[str, typing.Optional[dict]]:
+
+    locations: dict[str, typing.Optional[dict]] = {}
+    for batch in batches(filenames, NATIVE_AST_BATCH_SIZE):
+        locations.update(locate_failures(get_native_asts(batch)))
+
+    return locations
+
+def harvest_concurrently(filenames: typing.Iterable[str], workers: int) -> dict[str, typing.Optional[dict]]:
+
+    # a known list is split into at least one batch per worker,
+    # a stream of filenames is cut into fixed batches as it arrives
+    size = STREAMED_BATCH_SIZE
+    if isinstance(filenames, list):
+        size = max(1, min(NATIVE_AST_BATCH_SIZE, math.ceil(len(filenames) / workers)))
+
+    # two pools form a pipeline: while the dhscanner parser
+    # handles one batch, the native parser already works on the next
+    locations: dict[str, typing.Optional[dict]] = {}
+    native_futures: set[concurrent.futures.Future] = set()
+    dhscanner_futures: set[concurrent.futures.Future] = set()
+    with (
+        concurrent.futures.ThreadPoolExecutor(max_workers=workers) as native,
+        concurrent.futures.ThreadPoolExecutor(max_workers=workers) as dhscanner
+    ):
+        def advance(limit: int) -> None:
+
+            # finished batches move on and are dropped once located,
+            # so only the native asts of batches in flight stay alive
+            while len(native_futures) + len(dhscanner_futures) > limit:
+                done, _ = concurrent.futures.wait(native_futures | dhscanner_futures, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    if future in native_futures:
+                        native_futures.remove(future)
+                        dhscanner_futures.add(dhscanner.submit(metrics.nested(locate_failures), future.result()))
+                    else:
+                        dhscanner_futures.remove(future)
+                        locations.update(future.result())
+
+        for batch in batches(filenames, size):
+            native_futures.add(native.submit(metrics.nested(get_native_asts), batch))
+            advance(2 * workers)
+
+        advance(0)
+
+    return locations
+
+@metrics.timed('harvest')
+def harvest(filenames: typing.Iterable[str], workers: int) -> dict[str, typing.Optional[dict]]:
+
+    if workers > 1:
+        return harvest_concurrently(filenames, workers)
+
+    return harvest_sequentially(filenames)
+
+def store_parse_status(parsing_status_json_filename: str, filenames: list[str], locations: dict[str, typing.Optional[dict]]) -> None:
+
+    # keep the collected order so the output is
+    # identical regardless of the number of workers
+    status: dict[str, dict] = {}
+    for filename in filenames:
+        if location := locations.get(filename):
+            status[filename] = location
+
+    with open(parsing_status_json_filename, 'w', encoding='utf-8') as fl:
+        json.dump(status, fl, indent=4)
+
+def generate_initial_parse_status(parsing_status_json_filename: str, workers: int = 1) -> None:
+
+    # files are harvested while the walk still discovers the rest
+    discovered, filenames = itertools.tee(discovery.files(BENCHMARK_DIR))
+    locations = harvest(discovered, workers)
+    store_parse_status(parsing_status_json_filename, list(filenames), locations)
+
+SCORES_JSON_FILENAME: typing.Final[str] = 'scores.json'
+
+def grammar_fingerprint(tokens_json_filename: str, rules_python_filename: str) -> str:
+
+    with open(tokens_json_filename, encoding='utf-8') as fl:
+        tokens = fl.read()
+
+    with open(rules_python_filename, encoding='utf-8') as fl:
+        rules = fl.read()
+
+    return cache.fingerprint(tokens, rules)
+
+def load_scores(scores_json_filename: str) -> dict[str, dict]:
+
+    if not os.path.isfile(scores_json_filename):
+        return {}
+
+    with open(scores_json_filename, encoding='utf-8') as fl:
+        return json.load(fl)
+
+def select_for_rescoring(scores: dict[str, dict], sources: dict[str, str], fingerprint: str, sample_size: int) -> list[str]:
+
+    selected: list[str] = []
+    passing: list[str] = []
+    for filename, source in sources.items():
+        score = scores.get(filename)
+        if score is None or score['source'] != source:
+            selected.append(filename)
+        elif score['grammar'] == fingerprint:
+            continue
+        elif score['location'] is not None:
+            selected.append(filename)
+        else:
+            passing.append(filename)
+
+    selected.extend(random.sample(passing, min(sample_size, len(passing))))
+    return selected
+
+def generate_incremental_parse_status(
+    parsing_status_json_filename: str,
+    fingerprint: str,
+    workers: int = 1,
+    sample_size: int = REGRESSION_SAMPLE_SIZE,
+    scores_json_filename: str = SCORES_JSON_FILENAME
+) -> None:
+
+    # only new or changed files are read to fingerprint them
+    manifest = discovery.Manifest.load(BENCHMARK_DIR)
+    sources = { filename: source for filename, source, _ in manifest.scan(BENCHMARK_DIR) }
+    filenames = list(sources)
+    scores = load_scores(scores_json_filename)
+
+    selected = select_for_rescoring(scores, sources, fingerprint, sample_size)
+    logging.info('re-scoring %d out of %d files 🔁', len(selected), len(filenames))
+
+    for filename, location in harvest(selected, workers).items():
+        previous = scores.get(filename)
+        if previous and previous['location'] is None and location is not None:
+            logging.info('regression detected: %s 😬', filename)
+
+        scores[filename] = {
+            'source': sources[filename],
+            'grammar': fingerprint,
+            'location': location
+        }
+
+    # files that left the benchmark are forgotten
+    scores = { filename: scores[filename] for filename in filenames }
+    with open(scores_json_filename, 'w', encoding='utf-8') as fl:
+        json.dump(scores, fl, indent=4)
+
+    locations = { filename: score['location'] for filename, score in scores.items() }
+    store_parse_status(parsing_status_json_filename, filenames, locations)
+    manifest.store()
+
+# minimal snippets that fail like the benchmark files they were reduced from
+REDUCED_CORPUS_DIR: typing.Final[pathlib.Path] = pathlib.Path('benchmark/reduced')
+REDUCED_MANIFEST_FILENAME: typing.Final[pathlib.Path] = REDUCED_CORPUS_DIR / 'manifest.json'
+
+def load_reduced_manifest() -> dict[str, dict]:
+
+    if not REDUCED_MANIFEST_FILENAME.is_file():
+        return {}
+
+    with REDUCED_MANIFEST_FILENAME.open(encoding='utf-8') as fl:
+        return json.load(fl)
+
+def reduced_cases(parse_status: dict, manifest: dict[str, dict]) -> dict[str, str]:
+
+    # a reduced case only stands in for its original while the
+    # original is unchanged and still fails on the same line pattern
+    reduced: dict[str, str] = {}
+    for filename, location in parse_status.items():
+        case = manifest.get(filename)
+        if case is None or not os.path.isfile(case['reduced']) or not os.path.isfile(filename):
+            continue
+        if case['signature'] != failures.pattern_of(location):
+            continue
+        if case['source'] != cache.fingerprint(read_single_file(filename)['source'][1]):
+            continue
+        reduced[filename] = case['reduced']
+
+    return reduced
+
+@dataclasses.dataclass(frozen=True, kw_only=True)
+class Benchmark:
+
+    failing: list[str]
+    passing: list[str]
+    native_asts: list[tuple[str, spool.NativeAst]]
+    window: int = LOCATION_WINDOW
+    reduced: dict[str, str] = dataclasses.field(default_factory=dict)
+
+    @staticmethod
+    @metrics.timed('benchmark')
+    def create(
+        parse_status: dict,
+        window: int = LOCATION_WINDOW,
+        sample_size: int = REGRESSION_SAMPLE_SIZE,
+        reduced: typing.Optional[dict[str, str]] = None
+    ) -> Benchmark:
+
+        filenames = collect(BENCHMARK_DIR)
+        failing = [filename for filename in filenames if filename in parse_status]
+        passing = [filename for filename in filenames if filename not in parse_status]
+        passing = random.sample(passing, min(sample_size, len(passing)))
+
+        # a reduced case is parsed in place of its original, and
+        # the original is only parsed again once a candidate improves
+        cases = reduced or {}
+        reduced = { filename: cases[filename] for filename in failing if filename in cases }
+        sources = [reduced.get(filename, filename) for filename in failing] + passing
+        if reduced:
+            logging.info('%d failing files are scored through their reduced cases', len(reduced))
+
+        # native asts are shared by all candidates of the iteration
+        return Benchmark(
+            failing=failing,
+            passing=passing,
+            native_asts=[
+                (filename, native_ast)
+                for filename, (_, native_ast) in zip(failing + passing, get_native_asts(sources))
+            ],
+            window=window,
+            reduced=reduced
+        )
+
+    @functools.cached_property
+    def originals(self) -> list[tuple[str, spool.NativeAst]]:
+        return get_native_asts(list(self.reduced))
+
+    def scored(self, originals: bool) -> list[tuple[str, spool.NativeAst]]:
+        return self.originals if originals else self.native_asts
+
+    def check_improvement_with_new(self, parser: clients.DhscannerParserClient, originals: bool = False) -> dict[str, typing.Optional[dict]]:
+        return dict(locate_failures(self.scored(originals), parser, self.window))
+
+    def lexical_errors(self, scanner: interpreter.Scanner) -> int:
+
+        # tokenizes the benchmark once, before the candidates share it
+        count = 0
+        for _, native_ast in self.native_asts:
+            with token_stream(scanner, native_ast) as tokens:
+                count += int(tokens.lexical_error)
+
+        return count
+
+    def check_improvement_with_interpreter(self, parser: interpreter.Interpreter, originals: bool = False) -> dict[str, typing.Optional[dict]]:
+
+        # one stream is mapped at a time, however large the benchmark
+        locations: dict[str, typing.Optional[dict]] = {}
+        for filename, native_ast in self.scored(originals):
+            with token_stream(parser.scanner, native_ast) as tokens:
+                locations[filename] = parser.parse_stream(tokens, native_ast, self.window)
+
+        return locations
+
+    def fixed(self, locations: dict[str, typing.Optional[dict]]) -> int:
+        return sum(1 for filename in self.failing if locations[filename] is None)
+
+    def regressed(self, locations: dict[str, typing.Optional[dict]]) -> int:
+        return sum(1 for filename in self.passing if locations[filename] is not None)
+
+    def recheck(self, locations: dict[str, typing.Optional[dict]]) -> bool:
+
+        # locations of reduced cases must not end up under the names of
+        # their originals, so a candidate that may be accepted is scored
+        # on the originals again, and only they decide its improvement
+        return bool(self.reduced) and self.fixed(locations) > self.regressed(locations)
@@ -0,0 +1,315 @@
+from __future__ import annotations
+
+import re
+import array
+import typing
+import dataclasses
+
+import cache
+import spool
+import stream
+import analyzer
+
+# character classes predefined by alex
+ALEX_CHARSETS: typing.Final[dict[str, str]] = {
+    'white': ' \\t\\n\\f\\v\\r',
+    'printable': '\\x20-\\U0010ffff'
+}
+
+# same as alex_tab_size of the generated lexer
+TAB_SIZE: typing.Final[int] = 8
+
+# analyzer.VALUED_TOKENS in the order the generated lexer declares them:
+# alex breaks ties between equally long matches by that order, so the
+# interpreter must rank them the same way, a set would lose it
+VALUED_TOKEN_ORDER: typing.Final[list[str]] = ['ID', 'INT', 'STR', 'FLOAT']
+
+def escape(char: str) -> str:
+    return re.escape(char) if char in '\\]^-[' else char
+
+def macro(regex: str, index: int, macros: typing.Mapping[str, str]) -> tuple[str, str]:
+
+    # the name and the definition of the $ or @ reference at index
+    if not (match := re.match(r'\w+', regex[index + 1:])):
+        raise ValueError(f'malformed macro reference {regex[index:index + 8]!r} in {regex!r}')
+
+    name = match.group(0)
+    if name not in macros:
+        raise ValueError(f'unknown macro {regex[index]}{name} in {regex!r}')
+
+    return name, macros[name]
+
+def charset(regex: str, start: int) -> tuple[str, int]:
+
+    # translates an alex set expression [ ... ] starting
+    # right after its opening bracket, whitespace is ignored
+    items: list[str] = []
+    index = start
+    while regex[index] != ']':
+        char = regex[index]
+        if char.isspace():
+            index += 1
+        elif char == '$':
+            name, definition = macro(regex, index, ALEX_CHARSETS)
+            items.append(definition)
+            index += 1 + len(name)
+        elif char == '\\':
+            items.append(escape(regex[index + 1]))
+            index += 2
+        elif regex[index + 1] == '-' and regex[index + 2] != ']':
+            items.append(f'{escape(char)}-{escape(regex[index + 2])}')
+            index += 3
+        else:
+            items.append(escape(char))
+            index += 1
+
+    return f'[{"".join(items)}]', index + 1
+
+def translate(regex: str, macros: dict[str, str]) -> str:
+
+    # translates the subset of the alex regular expression
+    # syntax used by the tokens json into a python one
+    output: list[str] = []
+    index = 0
+    while index < len(regex):
+        char = regex[index]
+        if char.isspace():
+            index += 1
+        elif char == '"':
+            end = regex.index('"', index + 1)
+            output.append(re.escape(regex[index + 1:end]))
+            index = end + 1
+        elif char == '\\':
+            escaped = regex[index + 1]
+            output.append({ 'n': '\n', 't': '\t' }.get(escaped, re.escape(escaped)))
+            index += 2
+        elif char == '$':
+            name, definition = macro(regex, index, ALEX_CHARSETS)
+            output.append(f'[{definition}]')
+            index += 1 + len(name)
+        elif char == '@':
+            name, definition = macro(regex, index, macros)
+            output.append(f'(?:{definition})')
+            index += 1 + len(name)
+        elif char == '[':
+            translated, index = charset(regex, index + 1)
+            output.append(translated)
+        elif char == '(':
+            output.append('(?:')
+            index += 1
+        elif char == '.':
+            output.append('[^\n]')
+            index += 1
+        else:
+            output.append(char)
+            index += 1
+
+    return ''.join(output)
+
+def literal_of(regex: str) -> typing.Optional[str]:
+
+    if match := re.fullmatch(r'"([^"]*)"|(\w+)', regex):
+        return match.group(1) if match.group(1) is not None else match.group(2)
+
+    return None
+
+@dataclasses.dataclass(frozen=True, kw_only=True)
+class Scanner:
+
+    # token ids index the terminals, the signature
+    # identifies the tokens json the scanner was made of
+    terminals: list[str]
+    ids: dict[str, int]
+    signature: str
+
+    # all literal tokens in one alternation, longest first,
+    # mapped to their ( rank, token id )
+    literals: re.Pattern
+    literal_ranks: dict[str, tuple[int, int]]
+
+    # every other token is an optional lookahead group of
+    # one combined pattern, so a single match reports all of them
+    patterns: re.Pattern
+    pattern_ranks: list[tuple[int, typing.Optional[int]]]
+
+    @staticmethod
+    def create(tokens: list) -> Scanner:
+
+        # rules are ranked in the order of the generated lexer, so
+        # that equally long matches resolve the same way alex does
+        macros: dict[str, str] = {}
+        for entry in tokens:
+            macros[entry.name] = translate(entry.regex, macros)
+
+        terminals = list(dict.fromkeys([analyzer.literal(entry) for entry in tokens] + [analyzer.END]))
+        ids = { terminal: index for index, terminal in enumerate(terminals) }
+        ranked = [entry for entry in tokens if entry.name not in analyzer.VALUED_TOKENS]
+        by_name = { entry.name: entry for entry in tokens }
+
+        literal_ranks: dict[str, tuple[int, int]] = {}
+        patterns: list[str] = []
+        pattern_ranks: list[tuple[int, typing.Optional[int]]] = []
+        for rank, entry in enumerate(ranked):
+            text = literal_of(entry.regex)
+            if text:
+                literal_ranks.setdefault(text, (rank, ids[analyzer.literal(entry)]))
+            else:
+                patterns.append(macros[entry.name])
+                pattern_ranks.append((rank, ids[analyzer.literal(entry)]))
+
+        patterns.append(f'[{ALEX_CHARSETS["white"]}]+')
+        pattern_ranks.append((len(ranked), None))
+        for rank, name in enumerate(VALUED_TOKEN_ORDER, start=len(ranked) + 1):
+            if name in by_name:
+                patterns.append(macros[name])
+                pattern_ranks.append((rank, ids[name]))
+
+        ordered = sorted(literal_ranks, key=len, reverse=True)
+        return Scanner(
+            terminals=terminals,
+            ids=ids,
+            signature=cache.fingerprint(*[part for entry in tokens for part in (entry.name, entry.regex)]),
+            literals=re.compile('|'.join([re.escape(text) for text in ordered]) or '(?!)'),
+            literal_ranks=literal_ranks,
+            patterns=re.compile(''.join([f'(?:(?=({pattern}))|)' for pattern in patterns])),
+            pattern_ranks=pattern_ranks
+        )
+
+    def scan(self, content: str) -> stream.TokenStream:
+
+        ids = array.array('H')
+        lines = array.array('I')
+        col_starts = array.array('I')
+        col_ends = array.array('I')
+        lexical_error = False
+
+        index, line, col = 0, 1, 1
+        while index < len(content):
+
+            # longest match first, then the earliest rule
+            length, rank, token = 0, 0, None
+            if match := self.literals.match(content, index):
+                length = match.end() - index
+                rank, token = self.literal_ranks[match.group()]
+            patterns = self.patterns.match(content, index)
+            for matched, (pattern_rank, pattern_token) in zip(patterns.groups() if patterns else (), self.pattern_ranks):
+                if matched and (len(matched) > length or (len(matched) == length and pattern_rank < rank)):
+                    length, rank, token = len(matched), pattern_rank, pattern_token
+
+            # a lexical error ends the input right after the offending character
+            if length == 0:
+                line, col = advance(content[index], line, col)
+                lexical_error = True
+                break
+
+            if token is not None:
+                ids.append(token)
+                lines.append(line)
+                col_starts.append(col)
+                col_ends.append(col + length)
+
+            line, col = advance(content[index:index + length], line, col)
+            index += length
+
+        ids.append(self.ids[analyzer.END])
+        lines.append(line)
+        col_starts.append(col)
+        col_ends.append(col)
+
+        return stream.TokenStream(
+            ids=ids,
+            lines=lines,
+            col_starts=col_starts,
+            col_ends=col_ends,
+            lexical_error=lexical_error
+        )
+
+def advance(text: str, line: int, col: int) -> tuple[int, int]:
+
+    if '\n' not in text and '\t' not in text:
+        return line, col + len(text)
+
+    for char in text:
+        if char == '\n':
+            line, col = line + 1, 1
+        elif char == '\t':
+            col += TAB_SIZE - (col - 1) % TAB_SIZE
+        else:
+            col += 1
+
+    return line, col
+
+@dataclasses.dataclass(frozen=True, kw_only=True)
+class Interpreter:
+
+    scanner: Scanner
+    productions: tuple[analyzer.Production, ...]
+    actions: list[dict[int, tuple[str, int]]]
+    gotos: dict[tuple[int, str], int]
+
+    @staticmethod
+    def create(rules: list, tokens: list) -> typing.Optional[Interpreter]:
+
+        grammar = analyzer.Grammar.from_rules(rules)
+        if grammar.undefined or not grammar.productions:
+            return None
+
+        scanner = Scanner.create(tokens)
+        automaton = analyzer.Automaton.build(grammar)
+        actions = [resolve(automaton.actions(state)) for state in range(len(automaton.kernels))]
+        return Interpreter(
+            scanner=scanner,
+            productions=grammar.productions,
+            actions=[
+                { scanner.ids[terminal]: action for terminal, action in state.items() if terminal in scanner.ids }
+                for state in actions
+            ],
+            gotos={
+                (state, symbol): target
+                for (state, symbol), target in automaton.transitions.items()
+                if not analyzer.is_terminal(symbol)
+            }
+        )
+
+    def parse(self, native_ast: str, window: int = 0) -> typing.Optional[dict]:
+        return self.parse_stream(self.scanner.scan(native_ast), spool.NativeAst.from_text(native_ast), window)
+
+    def parse_stream(self, tokens: stream.TokenStream, native_ast: spool.NativeAst, window: int = 0) -> typing.Optional[dict]:
+
+        # semantic actions are ignored: only acceptance and
+        # the location of the failing token are of interest
+        stack = [0]
+        ids = tokens.ids
+        index = 0
+        while True:
+            action = self.actions[stack[-1]].get(ids[index])
+            if action is None:
+                return location_of(tokens, index, native_ast, window)
+
+            kind, target = action
+            if kind == 'shift':
+                stack.append(target)
+                index += 1
+            elif kind == 'reduce':
+                production = self.productions[target]
+                if production.rhs:
+                    del stack[-len(production.rhs):]
+                stack.append(self.gotos[(stack[-1], production.lhs)])
+            else:
+                return None
+
+def resolve(actions: dict[str, list[tuple[str, int]]]) -> dict[str, tuple[str, int]]:
+
+    # conflicts resolve the way happy resolves them: shift
+    # wins over reduce, the earlier production wins otherwise
+    resolved: dict[str, tuple[str, int]] = {}
+    for terminal, candidates in actions.items():
+        shifts = [action for action in candidates if action[0] == 'shift']
+        resolved[terminal] = shifts[0] if shifts else min(candidates, key=lambda action: action[1])
+
+    return resolved
+
+def location_of(tokens: stream.TokenStream, index: int, native_ast: spool.NativeAst, window: int = 0) -> dict:
+
+    # same shape as the locations extracted from the dhscanner parser errors
+    return native_ast.location(tokens.lines[index], tokens.col_starts[index], tokens.col_ends[index], window)
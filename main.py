@@ -1,19 +1,32 @@
 from __future__ import annotations
 
 import os
-import re
 import sys
-import glob
 import json
+import types
+import random
 import typing
+import asyncio
 import pathlib
 import logging
-import requests
 import argparse
 import subprocess
 import dataclasses
+import importlib.util
 
+import openai
 from openai import OpenAI
+from openai.types.chat import ChatCompletionMessageParam
+
+import cache
+import clients
+import context
+import metrics
+import failures
+import candidates
+import harvesting
+import interpreter
+import workspace
 
 
 ARGPARSE_PROG_DESC: typing.Final[str] = """
@@ -25,8 +38,68 @@ ARGPARSE_CONTENT_HELP: typing.Final[str] = """
 Path to input lexer.json
 """
 
+ARGPARSE_WORKERS_HELP: typing.Final[str] = """
+Number of concurrent workers used when harvesting the benchmark
+"""
+
+ARGPARSE_HARVEST_HELP: typing.Final[str] = """
+Harvest a fresh parsing status of the whole benchmark before iterating
+"""
+
+ARGPARSE_RESCORE_HELP: typing.Final[str] = """
+Before iterating, re-score only the files that changed since scores.json ( plus a sample of passing ones )
+"""
+
+ARGPARSE_ITERATIONS_HELP: typing.Final[str] = """
+Number of llm improvement iterations
+"""
+
+ARGPARSE_CANDIDATES_HELP: typing.Final[str] = """
+Number of candidate rules requested and evaluated per iteration
+"""
+
+ARGPARSE_LLM_REPLAY_ONLY_HELP: typing.Final[str] = """
+Only replay cached llm responses, never call the llm
+"""
+
+ARGPARSE_FAN_OUT_HELP: typing.Final[str] = """
+Send one concurrent llm request per failure cluster
+"""
+
+ARGPARSE_INTERPRET_HELP: typing.Final[str] = """
+Score candidates with the in-process parser, only the accepted one is built
+"""
+
+ARGPARSE_BUILDERS_HELP: typing.Final[str] = """
+Number of warm build workspaces, candidates compile concurrently in them
+"""
+
+ARGPARSE_LOCATION_WINDOW_HELP: typing.Final[str] = """
+Number of native ast lines kept before and after every failing line
+"""
+
+ARGPARSE_COMPRESS_HELP: typing.Final[str] = """
+Gzip the request and response bodies exchanged with both parsers
+"""
+
+ARGPARSE_NATIVE_PHP_PARSERS_HELP: typing.Final[str] = """
+Base urls of the native php parser replicas, requests go to the least busy one
+"""
+
+ARGPARSE_DHSCANNER_PARSERS_HELP: typing.Final[str] = """
+Base urls of the dhscanner parser replicas, requests go to the least busy one
+"""
+
+ARGPARSE_REDUCED_HELP: typing.Final[str] = """
+Score failing files through their reduced cases ( see minimize.py ) when available
+"""
+
 MODEL = "gpt-4o"
 
+NUM_ITERATIONS = 1
+
+NUM_CANDIDATES = 4
+
 logging.basicConfig(
     level=logging.INFO,
     format="[%(asctime)s] [%(levelname)s]: %(message)s",
@@ -41,6 +114,20 @@ class Argparse:
     rules_python_filename: pathlib.Path
     haskell_ast_filename: pathlib.Path
     parsing_status_json_filename: pathlib.Path
+    workers: int
+    harvest: bool
+    rescore: bool
+    iterations: int
+    candidates: int
+    llm_replay_only: bool
+    fan_out: bool
+    interpret: bool
+    builders: int
+    location_window: int
+    compress: bool
+    reduced: bool
+    native_php_parsers: list[str]
+    dhscanner_parsers: list[str]
 
     @staticmethod
     def run() -> typing.Optional[Argparse]:
@@ -85,6 +172,113 @@ class Argparse:
             help=ARGPARSE_CONTENT_HELP
         )
 
+        parser.add_argument(
+            '--workers',
+            required=False,
+            type=int,
+            default=1,
+            metavar="<num_workers>",
+            help=ARGPARSE_WORKERS_HELP
+        )
+
+        parser.add_argument(
+            '--harvest',
+            action='store_true',
+            help=ARGPARSE_HARVEST_HELP
+        )
+
+        parser.add_argument(
+            '--rescore',
+            action='store_true',
+            help=ARGPARSE_RESCORE_HELP
+        )
+
+        parser.add_argument(
+            '--iterations',
+            required=False,
+            type=int,
+            default=NUM_ITERATIONS,
+            metavar="<num_iterations>",
+            help=ARGPARSE_ITERATIONS_HELP
+        )
+
+        parser.add_argument(
+            '--candidates',
+            required=False,
+            type=int,
+            default=NUM_CANDIDATES,
+            metavar="<num_candidates>",
+            help=ARGPARSE_CANDIDATES_HELP
+        )
+
+        parser.add_argument(
+            '--llm_replay_only',
+            action='store_true',
+            help=ARGPARSE_LLM_REPLAY_ONLY_HELP
+        )
+
+        parser.add_argument(
+            '--fan_out',
+            action='store_true',
+            help=ARGPARSE_FAN_OUT_HELP
+        )
+
+        parser.add_argument(
+            '--interpret',
+            action='store_true',
+            help=ARGPARSE_INTERPRET_HELP
+        )
+
+        parser.add_argument(
+            '--builders',
+            required=False,
+            type=int,
+            default=workspace.POOL_SIZE,
+            metavar="<num_builders>",
+            help=ARGPARSE_BUILDERS_HELP
+        )
+
+        parser.add_argument(
+            '--location_window',
+            required=False,
+            type=int,
+            default=harvesting.LOCATION_WINDOW,
+            metavar="<num_lines>",
+            help=ARGPARSE_LOCATION_WINDOW_HELP
+        )
+
+        parser.add_argument(
+            '--compress',
+            action='store_true',
+            help=ARGPARSE_COMPRESS_HELP
+        )
+
+        parser.add_argument(
+            '--reduced',
+            action='store_true',
+            help=ARGPARSE_REDUCED_HELP
+        )
+
+        parser.add_argument(
+            '--native_php_parsers',
+            required=False,
+            type=str,
+            nargs='+',
+            default=harvesting.NATIVE_PHP_PARSER_REPLICAS,
+            metavar="<url>",
+            help=ARGPARSE_NATIVE_PHP_PARSERS_HELP
+        )
+
+        parser.add_argument(
+            '--dhscanner_parsers',
+            required=False,
+            type=str,
+            nargs='+',
+            default=harvesting.DHSCANNER_PARSER_REPLICAS,
+            metavar="<url>",
+            help=ARGPARSE_DHSCANNER_PARSERS_HELP
+        )
+
         args = parser.parse_args()
 
         logging.info('received required args 😊')
@@ -104,20 +298,56 @@ class Argparse:
             return None
 
         logging.info('rules python file exists 😊')
-        if not os.path.isfile(args.parsing_status):
+        if args.harvest and args.rescore:
+            logging.info('harvest and rescore are mutually exclusive 😬')
+            return None
+
+        # a harvest or a rescore creates the parsing status
+        harvested = args.harvest or args.rescore
+        if not harvested and not os.path.isfile(args.parsing_status):
             logging.info('parsing status file does not exist 😬')
             return None
 
-        logging.info('parsing status file exists 😊')
+        logging.info('parsing status file exists 😊' if not harvested else 'parsing status will be harvested 🌾')
+        if args.workers < 1:
+            logging.info('number of workers must be positive 😬')
+            return None
+
+        if args.candidates < 1:
+            logging.info('number of candidates must be positive 😬')
+            return None
+
+        if args.builders < 1:
+            logging.info('number of builders must be positive 😬')
+            return None
+
+        if args.location_window < 0:
+            logging.info('location window must not be negative 😬')
+            return None
+
         logging.info('finished checking validity of args: perfect 😊')
         return Argparse(
             tokens_json_filename=pathlib.Path(args.tokens_json),
             rules_python_filename=pathlib.Path(args.rules_python),
             haskell_ast_filename=pathlib.Path(args.haskell_ast),
-            parsing_status_json_filename=pathlib.Path(args.parsing_status)
+            parsing_status_json_filename=pathlib.Path(args.parsing_status),
+            workers=args.workers,
+            harvest=args.harvest,
+            rescore=args.rescore,
+            iterations=args.iterations,
+            candidates=args.candidates,
+            llm_replay_only=args.llm_replay_only,
+            fan_out=args.fan_out,
+            interpret=args.interpret,
+            builders=args.builders,
+            location_window=args.location_window,
+            compress=args.compress,
+            reduced=args.reduced,
+            native_php_parsers=args.native_php_parsers,
+            dhscanner_parsers=args.dhscanner_parsers
         )
 
-def load_tokens(tokens_json_filename: str) -> str:
+def load_tokens(tokens_json_filename: str | pathlib.Path) -> dict:
     with open(tokens_json_filename) as fl:
         tokens = json.load(fl)
 
@@ -128,176 +358,337 @@ def load_rules(rules_filename: str) -> str:
         rules = fl.read()
     return rules
 
-def load_haskell_ast(haskell_ast_filename: str) -> str:
+def load_haskell_ast(haskell_ast_filename: str | pathlib.Path) -> str:
     with open(haskell_ast_filename) as fl:
         rules = fl.read()
     return rules
 
-def load_parse_status(parse_status_json_filename: str) -> str:
+def load_parse_status(parse_status_json_filename: str | pathlib.Path) -> dict:
     with open(parse_status_json_filename) as fl:
         parse_status = json.load(fl)
     return parse_status
 
-NUM_ITERATIONS = 1
-
 def get_openai_api_key() -> typing.Optional[str]:
     return os.getenv('OPENAI_API_KEY')
 
-def get_system_prompt_message() -> str:
+def get_system_prompt_message() -> ChatCompletionMessageParam:
     with open('system_prompt.txt') as fl:
         system_prompt = fl.read()
 
     return { 'role': 'system', 'content': system_prompt }
 
-def get_user_prompt_message(tokens, rules, ast, parse_status) -> str:
+def get_user_prompt_message(tokens, rules, ast, parse_status, feedback) -> ChatCompletionMessageParam:
     content = (
         f'here is the tokens json file:\n\n{tokens}\n\n' +
-        f'here are the rules ( as global variable RULES inside this python file ):\n\n{rules}\n\n' +
+        f'here are the rules relevant to the failures ( a slice of the global variable RULES ):\n\n{rules}\n\n' +
         f'here is the Haskell Ast:\n\n{ast}' +
-        f'here is the parse status:\n\n{parse_status}'
+        f'here is the parse status:\n\n{parse_status}\n\n' +
+        f'here is the feedback from the previous iteration:\n\n{feedback}'
     )
     return { "role": "user", "content":  content}
 
-def call_llm(tokens, rules, ast, parse_status) -> str:
+LLM_CACHE_DIR: typing.Final[pathlib.Path] = pathlib.Path('.cache/llm')
+LLM_CACHE_MAX_BYTES: typing.Final[int] = 256 * 1024 * 1024
+LLM_CACHE_TTL: typing.Final[float] = 7 * 24 * 60 * 60
 
-    api_key = get_openai_api_key()
-    if api_key is None: return None
-
-    messages = [
-        get_system_prompt_message(),
-        get_user_prompt_message(tokens, rules, ast, parse_status)
-    ]
+LLM_CACHE: typing.Final[cache.DiskCache] = cache.DiskCache(
+    directory=LLM_CACHE_DIR,
+    max_bytes=LLM_CACHE_MAX_BYTES,
+    ttl=LLM_CACHE_TTL
+)
 
-    client = OpenAI(api_key=api_key)
-    response = client.chat.completions.create(
-        model=MODEL,
-        messages=messages
+def llm_cache_key(messages: list[ChatCompletionMessageParam], num_candidates: int) -> str:
+    return cache.fingerprint(
+        MODEL,
+        str(num_candidates),
+        *[str(message.get('content')) for message in messages]
     )
 
-    return response.choices[0].message.content
-
-def main(args: Argparse) -> None:
-
-    for i in range(NUM_ITERATIONS):
+def record_llm_usage(response: typing.Any) -> None:
+    metrics.count('llm_requests')
+    if usage := getattr(response, 'usage', None):
+        metrics.count('llm_prompt_tokens', usage.prompt_tokens or 0)
+        metrics.count('llm_completion_tokens', usage.completion_tokens or 0)
 
-        tokens = load_tokens(args.tokens_json_filename)
-        rules = load_rules(args.rules_python_filename)
-        ast = load_haskell_ast(args.haskell_ast_filename)
-        parse_status = load_parse_status(args.parsing_status_json_filename)
+@metrics.timed('llm')
+def call_llm(tokens, rules, ast, parse_status, feedback, num_candidates=1, replay_only=False) -> typing.Optional[list[str]]:
 
-        feedback = "this is the first iteration"
-
-        response = call_llm(tokens, rules, ast, parse_status)
-
-        if response is None:
-            logging.error('Invalid OpenAI token')
-            return
-
-        print(response)
-
-        #rule = Rule.extract(response)
-        #if not rule:
-        #    feedback = invalid_rule_returned(response)
-        
-        #if not Parser.generated_fine_with_new(rule):
-        #    feedback = invalid_parser_generated(rule)
-
-        #improvement = Benchmark.check_improvement_with_new(rule)
-        #if not improvement:
-        #    feedback = no_improvement_was_achieved(improvement)
-
-        # Yes ! improvement was achieved !
-        #accept_suggested_improvement(rule)
+    messages: list[ChatCompletionMessageParam] = [
+        get_system_prompt_message(),
+        get_user_prompt_message(tokens, rules, ast, parse_status, feedback)
+    ]
 
-def collect(workdir: str) -> None:
+    key = llm_cache_key(messages, num_candidates)
+    if (cached := LLM_CACHE.get(key)) is not None:
+        logging.info('replaying cached llm response 💾')
+        metrics.count('llm_cache_hits')
+        return json.loads(cached)
 
-    files: list[str] = []
-    filenames = glob.glob(f'{workdir}/**/*.php', recursive=True)
-    for filename in filenames:
-        if os.path.isfile(filename):
-            normalized = filename.replace("\\", "/")
-            files.append(normalized)
+    if replay_only:
+        logging.error('No cached llm response to replay')
+        return None
 
-    return files
+    api_key = get_openai_api_key()
+    if api_key is None:
+        logging.error('Invalid OpenAI token')
+        return None
 
-NATIVE_PHP_PARSER_URL: typing.Final[str] = 'http://127.0.0.1:5000/to/php/ast'
-DHSCANNER_PARSER_URL: typing.Final[str] = 'http://127.0.0.1:3000/from/php/to/dhscanner/ast'
+    client = OpenAI(api_key=api_key)
+    response = client.chat.completions.create(
+        model=MODEL,
+        messages=messages,
+        n=num_candidates
+    )
 
-def read_single_file(filename: str):
+    record_llm_usage(response)
+    contents = [choice.message.content or '' for choice in response.choices]
+    LLM_CACHE.put(key, json.dumps(contents))
+    return contents
 
-    with open(filename, 'r', encoding='utf-8') as fl:
-        code = fl.read()
+LLM_MAX_CONCURRENCY: typing.Final[int] = 4
+LLM_MAX_RETRIES: typing.Final[int] = 6
+LLM_BACKOFF_SECONDS: typing.Final[float] = 1.0
 
-    return { 'source': (filename, code) }
+# rate limits, dropped connections and 5xx answers are worth another try
+LLM_TRANSIENT_ERRORS: typing.Final[tuple[type[openai.APIError], ...]] = (
+    openai.RateLimitError,
+    openai.APIConnectionError,
+    openai.InternalServerError
+)
 
-CSRF_TOKEN_URL: typing.Final[str] = 'http://127.0.0.1:5000/csrf_token'
+def backoff_delay(error: openai.APIError, attempt: int) -> float:
+
+    # prefer the delay the api asks for, and fall
+    # back to exponential backoff with jitter
+    response = getattr(error, 'response', None)
+    if response is not None and (retry_after := response.headers.get('retry-after')) is not None:
+        try:
+            return float(retry_after)
+        except ValueError:
+            pass
+
+    return LLM_BACKOFF_SECONDS * (2 ** attempt) * (1 + random.random())
+
+async def call_llm_async(
+    client: typing.Optional[openai.AsyncOpenAI],
+    semaphore: asyncio.Semaphore,
+    messages: list[ChatCompletionMessageParam],
+    replay_only: bool
+) -> typing.Optional[str]:
+
+    key = llm_cache_key(messages, 1)
+    if (cached := LLM_CACHE.get(key)) is not None:
+        metrics.count('llm_cache_hits')
+        return json.loads(cached)[0]
+
+    if replay_only or client is None:
+        return None
+
+    async with semaphore:
+        for attempt in range(LLM_MAX_RETRIES):
+            try:
+                with metrics.span('llm_request'):
+                    response = await client.chat.completions.create(
+                        model=MODEL,
+                        messages=messages
+                    )
+                break
+            except LLM_TRANSIENT_ERRORS as e:
+                metrics.count('llm_rate_limited' if isinstance(e, openai.RateLimitError) else 'llm_transient_errors')
+                delay = backoff_delay(e, attempt)
+                logging.info('llm request failed ( %s ), retrying in %.1f seconds ⏳', type(e).__name__, delay)
+                await asyncio.sleep(delay)
+        else:
+            logging.error('llm retries exhausted')
+            return None
 
-def get_native_ast(filename: str) -> str:
+    record_llm_usage(response)
+    contents = [choice.message.content for choice in response.choices]
+    LLM_CACHE.put(key, json.dumps(contents))
+    return contents[0]
 
-    session = requests.Session()
-    response = session.get(CSRF_TOKEN_URL)
-    token = response.text
-    cookies = session.cookies
-    headers = { 'X-CSRF-TOKEN': token }
+async def fan_out_async(all_messages: list[list[ChatCompletionMessageParam]], replay_only: bool) -> list[typing.Optional[str]]:
 
-    response = session.post(
-        NATIVE_PHP_PARSER_URL,
-        files=read_single_file(filename),
-        headers=headers,
-        cookies=cookies
-    )
+    # retries of transient errors are handled by call_llm_async, which honors
+    # the rate limit, a cluster that still fails is dropped on its own
+    api_key = get_openai_api_key()
+    client = openai.AsyncOpenAI(api_key=api_key, max_retries=0) if api_key else None
+    semaphore = asyncio.Semaphore(LLM_MAX_CONCURRENCY)
+
+    results = await asyncio.gather(*[
+        call_llm_async(client, semaphore, messages, replay_only)
+        for messages in all_messages
+    ], return_exceptions=True)
+
+    responses: list[typing.Optional[str]] = []
+    for index, result in enumerate(results):
+        if isinstance(result, Exception):
+            logging.error('dropped failure cluster %d: %s', index, result)
+            metrics.count('llm_clusters_dropped')
+            responses.append(None)
+        elif isinstance(result, BaseException):
+            raise result
+        else:
+            responses.append(result)
+
+    return responses
+
+@metrics.timed('llm')
+def fan_out(rules_module: types.ModuleType, grammar: list, tokens, ast, failing: failures.FailureIndex, feedback, replay_only=False) -> typing.Optional[list[str]]:
+
+    all_messages: list[list[ChatCompletionMessageParam]] = []
+    for cluster in failing.clusters('token', context.MAX_CLUSTERS):
+        selected = context.select(grammar, tokens, ast, cluster)
+        all_messages.append([
+            get_system_prompt_message(),
+            get_user_prompt_message(
+                json.dumps(selected.tokens, indent=4),
+                f'RULES: list[Rule] = [\n{candidates.pythonify(selected.rules)}\n]',
+                selected.ast,
+                json.dumps(selected.parse_status, indent=4),
+                feedback
+            )
+        ])
+
+    logging.info('sending %d failure clusters to the llm', len(all_messages))
+    responses = [
+        response for response in asyncio.run(fan_out_async(all_messages, replay_only))
+        if response is not None
+    ]
 
-    return response.text
+    if not responses:
+        logging.error('No llm response for any failure cluster')
+        return None
 
-def get_dhscanner_status_for(filename: str, native_ast: str) -> dict:
+    # besides each cluster on its own, one more candidate
+    # combines the rules suggested for all the clusters
+    suggestions = [rules for response in responses if (rules := rules_module.Rule.extract(response))]
+    if len(suggestions) > 1:
+        combined = rules_module.combine_rules(suggestions)
+        responses.append(f'```python\n{candidates.pythonify(combined)}\n```')
 
-    url = DHSCANNER_PARSER_URL
-    content = { 'filename': filename, 'content': native_ast}
-    response = requests.post(f'{url}?filename={filename}', json=content)
-    return { 'filename': filename, 'status': json.loads(response.text) }
+    return responses
 
-def extract_location(message: str, native_ast: str) -> typing.Optional[dict]:
+def load_rules_module(rules_python_filename: pathlib.Path) -> types.ModuleType:
 
-    pattern = (
-        r'lineStart = (\d+), '
-        r'lineEnd = (\d+), '
-        r'colStart = (\d+), '
-        r'colEnd = (\d+)'
-    )
+    spec = importlib.util.spec_from_file_location('rules', rules_python_filename)
+    if spec is None or spec.loader is None:
+        raise ImportError(f'cannot load rules from {rules_python_filename}')
 
-    match = re.search(pattern, message)
+    module = importlib.util.module_from_spec(spec)
 
-    # print(match)
-    # print(message)
+    # dataclasses look their module up in sys.modules
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    return module
 
-    if match:
-        line_start, line_end, col_start, col_end = match.groups()
+def accept_suggested_improvement(
+    evaluation: candidates.Evaluation,
+    args: Argparse,
+    rules_module: types.ModuleType,
+    failing: failures.FailureIndex
+) -> bool:
 
-        lines = native_ast.split('\n')
-        start = int(line_start)
-        content = lines[start - 1]
+    # nothing else is touched when the grammar itself could not be stored
+    if not rules_module.store_rules(args.rules_python_filename, evaluation.grammar):
+        logging.info('could not store the rules of candidate %d 😬', evaluation.index)
+        return False
 
-        return {
-            "colStart": int(col_start),
-            "colEnd": int(col_end),
-            "content": content
-        }
+    # the accepted lexer and parser become the sources of the main parser container
+    # identical files are left alone, so the container only rebuilds what changed
+    assert evaluation.sources is not None, 'accepted candidates are always built'
+    for generated, filename in zip(evaluation.sources, [workspace.ALEX_FILENAME, workspace.HAPPY_FILENAME]):
+        generated.store(str(workspace.PARSER_PROJECT_DIR / filename))
 
-    return None
+    # only the re-scored files are re-indexed
+    failing.update(evaluation.locations)
+    failing.store_json(args.parsing_status_json_filename)
 
-def generate_initial_parse_status(parsing_status_json_filename: str) -> None:
+    logging.info('accepted candidate %d 😊', evaluation.index)
+    return True
 
-    filenames = collect('benchmark/single')
-    status: dict[str, dict] = {}
-    for filename in filenames:
-        native_ast = get_native_ast(filename)
-        parse_status = get_dhscanner_status_for(filename, native_ast)
-        message = parse_status['status']['message']
-        if location := extract_location(message, native_ast):
-            status[filename] = location
+def main(args: Argparse) -> None:
 
-    with open(parsing_status_json_filename, 'w') as fl:
-        json.dump(status, fl, indent=4)
+    rules_module = load_rules_module(args.rules_python_filename)
+    tokens_list = rules_module.from_tokens_json(args.tokens_json_filename)
+    if tokens_list is None:
+        return
+
+    harvesting.NATIVE_PHP_PARSER.compress = args.compress
+    harvesting.DHSCANNER_PARSER.compress = args.compress
+    harvesting.NATIVE_PHP_PARSER.replicas = clients.Replicas.create(args.native_php_parsers)
+    harvesting.DHSCANNER_PARSER.replicas = clients.Replicas.create(args.dhscanner_parsers)
+
+    grammar = rules_module.RULES
+    feedback = "this is the first iteration"
+
+    if args.harvest:
+        harvesting.generate_initial_parse_status(str(args.parsing_status_json_filename), args.workers)
+    elif args.rescore:
+        fingerprint = harvesting.grammar_fingerprint(str(args.tokens_json_filename), str(args.rules_python_filename))
+        harvesting.generate_incremental_parse_status(str(args.parsing_status_json_filename), fingerprint, args.workers)
+
+    failing = failures.FailureIndex.create(load_parse_status(args.parsing_status_json_filename))
+
+    # interpreted candidates only build the accepted one,
+    # so their workspace is created once one is accepted
+    pool = None if args.interpret else workspace.Pool.create(args.builders)
+
+    for i in range(args.iterations):
+        with metrics.span('iteration'):
+
+            tokens = load_tokens(args.tokens_json_filename)
+            ast = load_haskell_ast(args.haskell_ast_filename)
+            # failures of the most common failing token come first
+            parse_status = failing.prioritized('token')
+            for node, count in failing.top('node', 3):
+                logging.info('%d files fail on %s', count, node)
+
+            if args.fan_out:
+                responses = fan_out(rules_module, grammar, tokens, ast, failing, feedback, args.llm_replay_only)
+            else:
+                # only the part of the grammar around the failures goes to the llm
+                selected = context.select(grammar, tokens, ast, parse_status)
+                responses = call_llm(
+                    json.dumps(selected.tokens, indent=4),
+                    f'RULES: list[Rule] = [\n{candidates.pythonify(selected.rules)}\n]',
+                    selected.ast,
+                    json.dumps(selected.parse_status, indent=4),
+                    feedback,
+                    args.candidates,
+                    args.llm_replay_only
+                )
+
+            if responses is None:
+                return
+
+            logging.info('iteration %d: evaluating %d candidates', i, len(responses))
+            reduced = harvesting.reduced_cases(parse_status, harvesting.load_reduced_manifest()) if args.reduced else None
+            benchmark = harvesting.Benchmark.create(parse_status, args.location_window, reduced=reduced)
+            if args.interpret:
+                logging.info('%d benchmark files end with a lexical error', benchmark.lexical_errors(interpreter.Scanner.create(tokens_list)))
+            evaluations = candidates.evaluate_candidates(responses, rules_module, tokens_list, grammar, benchmark, pool)
+            best = max(evaluations, key=lambda evaluation: evaluation.improvement)
+
+            if best.improvement <= 0:
+                feedback = '\n\n'.join([evaluation.feedback for evaluation in evaluations])
+                continue
+
+            # interpreted candidates were never built
+            if best.sources is None:
+                if pool is None:
+                    pool = workspace.Pool.create(1)
+                best = candidates.confirm_interpreted_candidate(best, pool, rules_module, tokens_list, benchmark)
+                if best.improvement <= 0:
+                    feedback = best.feedback
+                    continue
+
+            # Yes ! improvement was achieved !
+            if not accept_suggested_improvement(best, args, rules_module, failing):
+                return
+
+            grammar = best.grammar
+            feedback = best.feedback
 
 def launch_services_successfully(docker_compose_yaml_filename: str) -> bool:
 
@@ -329,8 +720,10 @@ if __name__ == "__main__":
     if args := Argparse.run():
 
         #if launch_services_successfully('compose.parsers.yaml'):
-        #generate_initial_parse_status(args.parsing_status_json_filename)
-        main(args)
-        
+        try:
+            main(args)
+        finally:
+            metrics.store()
+
         # Arrrggghhhh ...
         #logging.error('Failed to launch parsing dockers')
@@ -0,0 +1,143 @@
+from __future__ import annotations
+
+import re
+import json
+import time
+import inspect
+import typing
+import pathlib
+import functools
+import threading
+import contextlib
+import contextvars
+import dataclasses
+
+# spans nest along the current thread or asyncio task, a span opened
+# in a worker thread starts a new root unless submitted with nested
+CURRENT_SPAN: contextvars.ContextVar[str] = contextvars.ContextVar('span', default='')
+
+PROMETHEUS_PREFIX: typing.Final[str] = 'dhscanner_helper'
+
+# every run overwrites the report of the previous one
+METRICS_JSON_FILENAME: typing.Final[pathlib.Path] = pathlib.Path('metrics.json')
+METRICS_PROMETHEUS_FILENAME: typing.Final[pathlib.Path] = pathlib.Path('metrics.prom')
+
+@dataclasses.dataclass(kw_only=True)
+class Timing:
+
+    count: int = 0
+    total: float = 0.0
+    max: float = 0.0
+
+    def add(self, elapsed: float) -> None:
+        self.count += 1
+        self.total += elapsed
+        self.max = max(self.max, elapsed)
+
+@dataclasses.dataclass(kw_only=True)
+class Registry:
+
+    started: float = dataclasses.field(default_factory=time.time)
+    timings: dict[str, Timing] = dataclasses.field(default_factory=dict)
+    counters: dict[str, float] = dataclasses.field(default_factory=dict)
+    lock: threading.Lock = dataclasses.field(default_factory=threading.Lock)
+
+    @contextlib.contextmanager
+    def span(self, name: str) -> typing.Iterator[None]:
+
+        parent = CURRENT_SPAN.get()
+        path = f'{parent}/{name}' if parent else name
+        token = CURRENT_SPAN.set(path)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            CURRENT_SPAN.reset(token)
+            with self.lock:
+                self.timings.setdefault(path, Timing()).add(elapsed)
+
+    def count(self, name: str, value: float = 1) -> None:
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def report(self) -> dict:
+        with self.lock:
+            return {
+                'started': self.started,
+                'elapsed': time.time() - self.started,
+                'spans': { path: dataclasses.asdict(timing) for path, timing in sorted(self.timings.items()) },
+                'counters': dict(sorted(self.counters.items()))
+            }
+
+    def prometheus(self) -> str:
+
+        def sanitize(name: str) -> str:
+            return re.sub(r'[^a-zA-Z0-9_]', '_', name)
+
+        report = self.report()
+        lines = [
+            f'# TYPE {PROMETHEUS_PREFIX}_span_seconds_total counter',
+            f'# TYPE {PROMETHEUS_PREFIX}_span_seconds_max gauge',
+            f'# TYPE {PROMETHEUS_PREFIX}_span_count_total counter'
+        ]
+        for path, timing in report['spans'].items():
+            label = json.dumps(path)
+            lines.append(f'{PROMETHEUS_PREFIX}_span_seconds_total{{span={label}}} {timing["total"]}')
+            lines.append(f'{PROMETHEUS_PREFIX}_span_seconds_max{{span={label}}} {timing["max"]}')
+            lines.append(f'{PROMETHEUS_PREFIX}_span_count_total{{span={label}}} {timing["count"]}')
+
+        for name, value in report['counters'].items():
+            metric = f'{PROMETHEUS_PREFIX}_{sanitize(name)}_total'
+            lines.append(f'# TYPE {metric} counter')
+            lines.append(f'{metric} {value}')
+
+        return '\n'.join(lines) + '\n'
+
+    def store(self, json_filename: pathlib.Path, prometheus_filename: pathlib.Path) -> None:
+
+        with json_filename.open('w', encoding='utf-8') as fl:
+            json.dump(self.report(), fl, indent=4)
+
+        with prometheus_filename.open('w', encoding='utf-8') as fl:
+            fl.write(self.prometheus())
+
+# a single registry per process, shared by every module
+REGISTRY: typing.Final[Registry] = Registry()
+
+def span(name: str) -> typing.ContextManager[None]:
+    return REGISTRY.span(name)
+
+def count(name: str, value: float = 1) -> None:
+    REGISTRY.count(name, value)
+
+def nested(function: typing.Callable) -> typing.Callable:
+
+    # runs the function, typically in a worker thread,
+    # under the spans that are open when it is submitted
+    return functools.partial(contextvars.copy_context().run, function)
+
+def timed(name: str) -> typing.Callable:
+
+    def decorator(function: typing.Callable) -> typing.Callable:
+
+        if inspect.iscoroutinefunction(function):
+            @functools.wraps(function)
+            async def async_wrapper(*args, **kwargs):
+                with span(name):
+                    return await function(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return function(*args, **kwargs)
+        return wrapper
+
+    return decorator
+
+def store(
+    json_filename: pathlib.Path = METRICS_JSON_FILENAME,
+    prometheus_filename: pathlib.Path = METRICS_PROMETHEUS_FILENAME
+) -> None:
+    REGISTRY.store(json_filename, prometheus_filename)
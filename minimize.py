@@ -0,0 +1,215 @@
+from __future__ import annotations
+
+import os
+import json
+import math
+import typing
+import logging
+import pathlib
+import argparse
+import dataclasses
+import concurrent.futures
+
+import main
+import cache
+import spool
+import failures
+import harvesting
+
+ARGPARSE_PROG_DESC: typing.Final[str] = """
+
+Shrinks failing benchmark files to minimal php snippets that fail the same way
+"""
+
+ARGPARSE_PARSING_STATUS_HELP: typing.Final[str] = """
+Path to the parsing status json, every failing file in it is minimized
+"""
+
+ARGPARSE_WORKERS_HELP: typing.Final[str] = """
+Number of files minimized concurrently
+"""
+
+ARGPARSE_MAX_TESTS_HELP: typing.Final[str] = """
+Maximal number of candidate snippets sent to the parsers per file
+"""
+
+MAX_TESTS: typing.Final[int] = 2000
+
+@dataclasses.dataclass(frozen=True, kw_only=True)
+class Argparse:
+
+    parsing_status_json_filename: pathlib.Path
+    workers: int
+    max_tests: int
+
+    @staticmethod
+    def run() -> typing.Optional[Argparse]:
+
+        parser = argparse.ArgumentParser(
+            description=ARGPARSE_PROG_DESC
+        )
+
+        parser.add_argument(
+            '--parsing_status',
+            required=True,
+            type=str,
+            metavar="<parse_status>.json",
+            help=ARGPARSE_PARSING_STATUS_HELP
+        )
+
+        parser.add_argument(
+            '--workers',
+            required=False,
+            type=int,
+            default=1,
+            metavar="<num_workers>",
+            help=ARGPARSE_WORKERS_HELP
+        )
+
+        parser.add_argument(
+            '--max_tests',
+            required=False,
+            type=int,
+            default=MAX_TESTS,
+            metavar="<num_tests>",
+            help=ARGPARSE_MAX_TESTS_HELP
+        )
+
+        args = parser.parse_args()
+
+        if not os.path.isfile(args.parsing_status):
+            logging.info('parsing status file does not exist 😬')
+            return None
+
+        if args.workers < 1 or args.max_tests < 1:
+            logging.info('workers and tests must be positive 😬')
+            return None
+
+        return Argparse(
+            parsing_status_json_filename=pathlib.Path(args.parsing_status),
+            workers=args.workers,
+            max_tests=args.max_tests
+        )
+
+def locate(filename: str, candidates: list[str]) -> list[typing.Optional[dict]]:
+
+    # both parsers are the oracle, none of the
+    # throwaway candidates goes into the native ast cache
+    locations: list[typing.Optional[dict]] = []
+    for start in range(0, len(candidates), harvesting.DHSCANNER_BATCH_SIZE):
+        batch = candidates[start:start + harvesting.DHSCANNER_BATCH_SIZE]
+        native_asts = list(harvesting.NATIVE_PHP_PARSER.post_batch([(filename, code) for code in batch]))
+        parsable = [
+            (index, native_ast) for index, native_ast in enumerate(native_asts)
+            if not native_ast.startswith(harvesting.NATIVE_PARSE_ERROR)
+        ]
+
+        found: list[typing.Optional[dict]] = [None] * len(batch)
+        native_asts_of = [(filename, spool.NativeAst.from_text(native_ast)) for _, native_ast in parsable]
+        for (index, _), (_, location) in zip(parsable, harvesting.locate_failures(native_asts_of, harvesting.DHSCANNER_PARSER, harvesting.LOCATION_WINDOW)):
+            found[index] = location
+
+        locations.extend(found)
+
+    return locations
+
+def ddmin(lines: list[str], fails: typing.Callable[[list[list[str]]], list[bool]]) -> list[str]:
+
+    # the delta debugging of zeller and hildebrandt, except that all
+    # subsets and complements of a round go to the oracle in one batch
+    granularity = 2
+    while len(lines) >= 2:
+        size = math.ceil(len(lines) / granularity)
+        starts = range(0, len(lines), size)
+        subsets = [lines[start:start + size] for start in starts]
+        complements = [lines[:start] + lines[start + size:] for start in starts]
+
+        results = fails(subsets + complements)
+        if True in results[:len(subsets)]:
+            lines = subsets[results.index(True)]
+            granularity = 2
+        elif True in results[len(subsets):]:
+            lines = complements[results.index(True, len(subsets)) - len(subsets)]
+            granularity = max(granularity - 1, 2)
+        elif granularity >= len(lines):
+            break
+        else:
+            granularity = min(granularity * 2, len(lines))
+
+    return lines
+
+@dataclasses.dataclass(kw_only=True)
+class Budget:
+
+    # the oracle says no once the budget is spent,
+    # so ddmin settles on the smallest case found so far
+    remaining: int
+
+    def spend(self, count: int) -> bool:
+        self.remaining -= count
+        return self.remaining >= 0
+
+def minimize(filename: str, max_tests: int) -> typing.Optional[dict]:
+
+    # blade templates are reduced in their compiled form
+    code = harvesting.read_sources([filename])[filename]
+    location = locate(filename, [code])[0] if code is not None else None
+    if location is None:
+        logging.info('%s does not fail anymore 😊', filename)
+        return None
+
+    signature = failures.pattern_of(location)
+    budget = Budget(remaining=max_tests)
+
+    def fails(candidates: list[list[str]]) -> list[bool]:
+        if not budget.spend(len(candidates)):
+            return [False] * len(candidates)
+
+        return [
+            found is not None and failures.pattern_of(found) == signature
+            for found in locate(filename, [''.join(lines) for lines in candidates])
+        ]
+
+    lines = code.splitlines(keepends=True)
+    reduced = ''.join(ddmin(lines, fails))
+    # a compiled template is plain php, so its case must not look like a template
+    relative = pathlib.Path(filename).relative_to(harvesting.BENCHMARK_DIR)
+    if filename.endswith(harvesting.BLADE_SUFFIX):
+        relative = relative.with_name(relative.name.removesuffix(harvesting.BLADE_SUFFIX) + '.php')
+    reduced_filename = harvesting.REDUCED_CORPUS_DIR / relative
+    reduced_filename.parent.mkdir(parents=True, exist_ok=True)
+    reduced_filename.write_text(reduced, encoding='utf-8')
+
+    logging.info('%s: %d lines reduced to %d 😊', filename, len(lines), len(reduced.splitlines()))
+    return {
+        'reduced': reduced_filename.as_posix(),
+        'source': cache.fingerprint(harvesting.read_single_file(filename)['source'][1]),
+        'signature': signature
+    }
+
+def run(args: Argparse) -> None:
+
+    parse_status = main.load_parse_status(args.parsing_status_json_filename)
+    manifest = harvesting.load_reduced_manifest()
+
+    # cases whose original is unchanged and fails the same way are kept
+    current = harvesting.reduced_cases(parse_status, manifest)
+    pending = [filename for filename in parse_status if filename not in current]
+    logging.info('minimizing %d failing files, %d are already reduced', len(pending), len(current))
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=args.workers) as executor:
+        futures = [executor.submit(minimize, filename, args.max_tests) for filename in pending]
+        for filename, future in zip(pending, futures):
+            if case := future.result():
+                manifest[filename] = case
+            else:
+                manifest.pop(filename, None)
+
+    harvesting.REDUCED_MANIFEST_FILENAME.parent.mkdir(parents=True, exist_ok=True)
+    with harvesting.REDUCED_MANIFEST_FILENAME.open('w') as fl:
+        json.dump(manifest, fl, indent=4)
+
+if __name__ == '__main__':
+
+    if args := Argparse.run():
+        run(args)
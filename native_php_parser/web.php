@@ -18,9 +18,21 @@ use Illuminate\View\Compilers\BladeCompiler;
 
 config(['logging.default' => 'errorlog']);
 
+// dumps repeat node names and positions all over,
+// so even the fastest compression level pays off
+$gzipLevel = 1;
+$acceptsGzip = fn (Request $request) => str_contains($request->header('Accept-Encoding', ''), 'gzip');
+
 Route::get('/csrf_token', function() { return csrf_token(); });
 
-Route::post('/to/php/ast', function (Request $request) {
+// the helper keeps replicas that fail this out of its rotation
+Route::get('/healthcheck', function() { return response()->json(['healthy' => true]); });
+
+Route::get('/php_parser_version', function() {
+    return \Composer\InstalledVersions::getPrettyVersion('nikic/php-parser');
+});
+
+Route::post('/to/php/ast', function (Request $request) use ($acceptsGzip, $gzipLevel) {
 
     $file = $request->file('source');
     if (!$file) { return "ERROR"; }
@@ -32,10 +44,69 @@ Route::post('/to/php/ast', function (Request $request) {
     catch (Error $error) { return "ERROR"; }
 
     $dumper = new NodeDumper(['dumpPositions' => true]);
-    return $dumper->dump($ast, $code) . "\n";
+    $dump = $dumper->dump($ast, $code) . "\n";
+    if (!$acceptsGzip($request)) { return $dump; }
+
+    return response(gzencode($dump, $gzipLevel))
+        ->header('Content-Type', 'text/plain')
+        ->header('Content-Encoding', 'gzip');
 });
 
-Route::post('/to/php/code', function (Request $request) {
+Route::post('/to/php/asts', function (Request $request) use ($acceptsGzip, $gzipLevel) {
+
+    $files = $request->file('sources');
+    if (!$files) { return response('ERROR: No files uploaded', 400); }
+
+    // a single parser and dumper serve the whole batch
+    $parser = (new ParserFactory())->createForNewestSupportedVersion();
+    $dumper = new NodeDumper(['dumpPositions' => true]);
+
+    // one json line per file, in upload order, flushed
+    // as soon as it is ready so the client can start early,
+    // a sync flush keeps a compressed stream just as incremental
+    $gzip = $acceptsGzip($request);
+    $headers = ['Content-Type' => 'application/x-ndjson'];
+    if ($gzip) { $headers['Content-Encoding'] = 'gzip'; }
+
+    return response()->stream(function () use ($files, $parser, $dumper, $gzip, $gzipLevel) {
+        $deflate = $gzip ? deflate_init(ZLIB_ENCODING_GZIP, ['level' => $gzipLevel]) : null;
+        foreach ($files as $index => $file) {
+            $code = file_get_contents($file);
+            try { $ast = $dumper->dump($parser->parse($code), $code) . "\n"; }
+            catch (Error $error) { $ast = "ERROR"; }
+            $line = json_encode(['index' => $index, 'ast' => $ast]) . "\n";
+            echo $gzip ? deflate_add($deflate, $line, ZLIB_SYNC_FLUSH) : $line;
+            flush();
+        }
+        if ($gzip) { echo deflate_add($deflate, '', ZLIB_FINISH); }
+    }, 200, $headers);
+});
+
+// the blade directives that pull in other views are dropped,
+// one alternation strips all of them in a single pass
+$bladeStrip = '/@(?:include|extends)\((?:.*?)\)|(?s:@section.*?@endsection)/';
+
+// one compiler serves every template of the process,
+// it only writes compiled views when asked to, which it never is
+$bladeCompiler = function () {
+    static $compiler = null;
+    $compiler ??= new BladeCompiler(new Filesystem(), sys_get_temp_dir());
+    return $compiler;
+};
+
+// the php statements out of the tags of a compiled template
+$bladeToPhp = function (string $content) use ($bladeStrip, $bladeCompiler) {
+    $compiled = $bladeCompiler()->compileString(preg_replace($bladeStrip, '', $content));
+    preg_match_all('/<\?php\s+(.*?)\s*\?>/s', $compiled, $matches);
+    $statements = array_filter($matches[1]);
+    return "<?php\n" . implode(";\n", $statements) . ";\n";
+};
+
+Route::get('/blade_compiler_version', function() {
+    return \Composer\InstalledVersions::getPrettyVersion('laravel/framework');
+});
+
+Route::post('/to/php/code', function (Request $request) use ($bladeToPhp) {
     $file = $request->file('source');
     if (!$file) {
         return response('ERROR: No file uploaded', 400);
@@ -43,27 +114,9 @@ Route::post('/to/php/code', function (Request $request) {
 
     $content = file_get_contents($file);
 
-    // ⚠️ Strip problematic Blade directives (optional but useful)
-    $content = preg_replace('/@include\((.*?)\)/', '', $content);
-    $content = preg_replace('/@extends\((.*?)\)/', '', $content);
-    $content = preg_replace('/@section(.*?)@endsection/s', '', $content);
-
-    // Blade compiler needs an available directory
-    // for writing temporary files
-    $filesystem = new Filesystem();
-    $tempDir = sys_get_temp_dir();
-
-    // Compile with BladeCompiler
-    $compiler = new BladeCompiler($filesystem, $tempDir);
-
-    try { $compiled = $compiler->compileString($content); }
+    try { $code = $bladeToPhp($content); }
     catch (\Throwable $e) { return response("ERROR: " . $e->getMessage(), 400); }
 
-    // now extract actual php code from relevant tags
-    preg_match_all('/<\?php\s+(.*?)\s*\?>/s', $compiled, $matches);
-    $statements = array_filter($matches[1]);
-    $code = implode(";\n", $statements) . ";\n";
-
     // for some debug options
     $originalName = $file->getClientOriginalName();
     $end = 'link-display.blade.php';
@@ -76,5 +129,28 @@ Route::post('/to/php/code', function (Request $request) {
         Log::info($message);        
     }
 
-    return response("<?php\n" . $code)->header('Content-Type', 'text/plain');
+    return response($code)->header('Content-Type', 'text/plain');
+});
+
+Route::post('/to/php/codes', function (Request $request) use ($bladeToPhp, $acceptsGzip, $gzipLevel) {
+
+    $files = $request->file('sources');
+    if (!$files) { return response('ERROR: No files uploaded', 400); }
+
+    // one json line per template, in upload order, exactly like /to/php/asts
+    $gzip = $acceptsGzip($request);
+    $headers = ['Content-Type' => 'application/x-ndjson'];
+    if ($gzip) { $headers['Content-Encoding'] = 'gzip'; }
+
+    return response()->stream(function () use ($files, $bladeToPhp, $gzip, $gzipLevel) {
+        $deflate = $gzip ? deflate_init(ZLIB_ENCODING_GZIP, ['level' => $gzipLevel]) : null;
+        foreach ($files as $index => $file) {
+            try { $code = $bladeToPhp(file_get_contents($file)); }
+            catch (\Throwable $e) { $code = null; }
+            $line = json_encode(['index' => $index, 'code' => $code]) . "\n";
+            echo $gzip ? deflate_add($deflate, $line, ZLIB_SYNC_FLUSH) : $line;
+            flush();
+        }
+        if ($gzip) { echo deflate_add($deflate, '', ZLIB_FINISH); }
+    }, 200, $headers);
 });
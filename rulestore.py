@@ -0,0 +1,234 @@
+from __future__ import annotations
+
+import json
+import types
+import typing
+import pathlib
+import logging
+import dataclasses
+
+import analyzer
+
+# a symbol is kept in its happy notation: 'Stmt_Echo', ID, loc, listof(exp)
+Symbol = str
+
+@dataclasses.dataclass(frozen=True, slots=True)
+class Record:
+
+    lhs: str
+    alternatives: tuple[tuple[Symbol, ...], ...]
+    action: str
+    choice: bool
+
+    def tokens(self) -> set[str]:
+        return { token for alternative in self.alternatives for symbol in alternative for token in tokens_of(symbol) }
+
+    def variables(self) -> set[str]:
+        return { variable for alternative in self.alternatives for symbol in alternative for variable in variables_of(symbol) }
+
+def tokens_of(symbol: Symbol) -> list[str]:
+
+    # token names as the rules spell them, without the quotes
+    if symbol.startswith("'"):
+        return [symbol[1:-1]]
+    if analyzer.is_terminal(symbol):
+        return [symbol]
+    if parametrized := analyzer.parametrized(symbol):
+        body = analyzer.PARAMETRIZED_BODIES.get(parametrized[0], [])
+        return [token for alternative in body for element in alternative if element.startswith("'") for token in tokens_of(element)]
+
+    return []
+
+def variables_of(symbol: Symbol) -> list[str]:
+
+    if analyzer.is_terminal(symbol):
+        return []
+    if parametrized := analyzer.parametrized(symbol):
+        return variables_of(parametrized[1])
+
+    return [symbol]
+
+def from_json_symbol(element: dict) -> typing.Optional[Symbol]:
+
+    # valued tokens appear as variables in the json, which is
+    # exactly their happy notation, so both map to themselves
+    if isinstance(element.get('token'), str):
+        return element['token']
+    if isinstance(element.get('variable'), str):
+        return element['variable']
+
+    return None
+
+def to_json_symbol(symbol: Symbol) -> dict:
+
+    if symbol.startswith("'"):
+        return { 'token': symbol }
+
+    return { 'variable': symbol }
+
+@dataclasses.dataclass(frozen=True, kw_only=True)
+class RuleStore:
+
+    records: tuple[Record, ...]
+    by_lhs: dict[str, tuple[int, ...]]
+    by_token: dict[str, tuple[int, ...]]
+
+    @staticmethod
+    def create(records: typing.Iterable[Record]) -> RuleStore:
+
+        records = tuple(records)
+        by_lhs: dict[str, list[int]] = {}
+        by_token: dict[str, list[int]] = {}
+        for index, record in enumerate(records):
+            by_lhs.setdefault(record.lhs, []).append(index)
+            for token in sorted(record.tokens()):
+                by_token.setdefault(token, []).append(index)
+
+        return RuleStore(
+            records=records,
+            by_lhs={ key: tuple(value) for key, value in by_lhs.items() },
+            by_token={ key: tuple(value) for key, value in by_token.items() }
+        )
+
+    @staticmethod
+    def from_rules(rules: list) -> RuleStore:
+
+        # choices carry their variables in content and have no action
+        return RuleStore.create(
+            Record(
+                lhs=str(rule.lhs),
+                alternatives=tuple(tuple(alternative) for alternative in rule.alternatives()),
+                action=str(getattr(rule, 'action', '')),
+                choice=hasattr(rule, 'content')
+            )
+            for rule in rules
+        )
+
+    @staticmethod
+    def from_json(data: typing.Any) -> typing.Optional[RuleStore]:
+
+        if not isinstance(data, list):
+            logging.error('Invalid rules json schema ( not a list )')
+            return None
+
+        records: list[Record] = []
+        for entry in data:
+            try:
+                lhs = entry['LHS']['lhs']
+                derived = entry['derived']
+                choice = 'choice' in derived
+                alternatives = derived['choice'] if choice else [derived['sequence']]
+                symbols = [[from_json_symbol(element) for element in alternative] for alternative in alternatives]
+            except (KeyError, TypeError):
+                logging.error('Invalid rules json schema: %s', entry)
+                return None
+
+            known = [[symbol for symbol in alternative if symbol is not None] for alternative in symbols]
+            if any(len(alternative) != len(original) for alternative, original in zip(known, symbols)):
+                logging.error('Invalid rules json schema ( unknown element ): %s', entry)
+                return None
+
+            records.append(Record(
+                lhs=lhs,
+                alternatives=tuple(tuple(alternative) for alternative in known),
+                action=entry.get('action', ''),
+                choice=choice
+            ))
+
+        return RuleStore.create(records)
+
+    @staticmethod
+    def load_json(filename: pathlib.Path) -> typing.Optional[RuleStore]:
+        try:
+            with filename.open() as fl:
+                data = json.load(fl)
+        except OSError:
+            logging.error('Fatal error reading %s', filename)
+            return None
+        except json.JSONDecodeError:
+            logging.error('Invalid json file: %s', filename)
+            return None
+
+        return RuleStore.from_json(data)
+
+    def to_json(self) -> list[dict]:
+
+        def derived(record: Record) -> dict:
+            if record.choice:
+                return { 'choice': [[to_json_symbol(symbol) for symbol in alternative] for alternative in record.alternatives] }
+            return { 'sequence': [to_json_symbol(symbol) for symbol in record.alternatives[0]] }
+
+        return [
+            { 'LHS': { 'lhs': record.lhs }, 'derived': derived(record), 'action': record.action }
+            for record in self.records
+        ]
+
+    def store_json(self, filename: pathlib.Path) -> None:
+        with filename.open('w', encoding='utf-8') as fl:
+            json.dump(self.to_json(), fl, indent=2)
+
+    def to_rules(self, rules_module: types.ModuleType) -> typing.Optional[list]:
+
+        def derived(symbol: Symbol) -> typing.Any:
+            if symbol.startswith("'"):
+                return rules_module.Token(symbol[1:-1])
+            if analyzer.is_terminal(symbol):
+                return rules_module.Token(symbol)
+            if parametrized := analyzer.parametrized(symbol):
+                return rules_module.Parametrized(parametrized[0], rules_module.Variable(parametrized[1]))
+            return rules_module.Variable(symbol)
+
+        rules: list = []
+        for record in self.records:
+            lhs = rules_module.Lhs(record.lhs)
+            if not record.choice:
+                rules.append(rules_module.RuleSequence(
+                    lhs,
+                    [derived(symbol) for symbol in record.alternatives[0]],
+                    rules_module.Action(record.action)
+                ))
+            elif all(len(alternative) == 1 and not analyzer.is_terminal(alternative[0]) for alternative in record.alternatives):
+                rules.append(rules_module.RuleChoice(lhs, [derived(alternative[0]) for alternative in record.alternatives]))
+            else:
+                # python choices only hold single variables
+                logging.error('choice of %s has alternatives that are not single variables', record.lhs)
+                return None
+
+        return rules
+
+    def definitions(self, lhs: str) -> list[Record]:
+        return [self.records[index] for index in self.by_lhs.get(lhs, ())]
+
+    def using_token(self, token: str) -> list[Record]:
+        return [self.records[index] for index in self.by_token.get(token, ())]
+
+    def duplicated(self) -> list[tuple[str, tuple[Symbol, ...]]]:
+
+        # the same production, either within one rule or across rules
+        seen: set[tuple[str, tuple[Symbol, ...]]] = set()
+        duplicated: list[tuple[str, tuple[Symbol, ...]]] = []
+        for record in self.records:
+            for alternative in record.alternatives:
+                production = (record.lhs, alternative)
+                if production in seen and production not in duplicated:
+                    duplicated.append(production)
+                seen.add(production)
+
+        return duplicated
+
+    def subsumed(self) -> list[tuple[str, tuple[Symbol, ...]]]:
+
+        # A -> α is subsumed when A -> B and B -> α exist as well,
+        # since α is then derived through B already
+        productions: dict[str, set[tuple[Symbol, ...]]] = {}
+        for record in self.records:
+            productions.setdefault(record.lhs, set()).update(record.alternatives)
+
+        subsumed: list[tuple[str, tuple[Symbol, ...]]] = []
+        for record in self.records:
+            units = [alternative[0] for alternative in record.alternatives if len(alternative) == 1 and alternative[0] in productions and alternative[0] != record.lhs]
+            for alternative in record.alternatives:
+                if any(alternative in productions[unit] for unit in units if (unit,) != alternative):
+                    subsumed.append((record.lhs, alternative))
+
+        return subsumed
@@ -0,0 +1,120 @@
+from __future__ import annotations
+
+import array
+import bisect
+import typing
+import pathlib
+import functools
+import contextlib
+import dataclasses
+
+import cache
+
+# native asts are streamed in chunks of this size, and their
+# line index keeps one checkpoint per chunk of the dump
+CHUNK_SIZE: typing.Final[int] = 1024 * 1024
+
+@dataclasses.dataclass(frozen=True, kw_only=True)
+class NativeAst:
+
+    # a cached dump is kept as the path of its entry and mapped only while
+    # it is read, so no file descriptor outlives a lookup, a dump that was
+    # never cached keeps its bytes, the key identifies either one
+    key: str
+    path: typing.Optional[pathlib.Path] = None
+    data: bytes = b''
+
+    # puts the dump back into the cache once its entry was evicted
+    fetch: typing.Optional[typing.Callable[[], pathlib.Path]] = None
+
+    @staticmethod
+    def from_text(text: str) -> NativeAst:
+        return NativeAst(key=cache.fingerprint(text), data=text.encode('utf-8'))
+
+    @contextlib.contextmanager
+    def buffer(self) -> typing.Iterator[typing.Any]:
+
+        if self.path is None:
+            yield self.data
+            return
+
+        # an evicted entry is fetched again, it never reads as empty
+        try:
+            mapped = cache.map_file(self.path)
+        except FileNotFoundError:
+            if self.fetch is None:
+                raise
+            mapped = cache.map_file(self.fetch())
+
+        if mapped is None:
+            yield b''
+            return
+
+        with mapped:
+            yield mapped
+
+    def __len__(self) -> int:
+
+        if self.path is None:
+            return len(self.data)
+
+        try:
+            return self.path.stat().st_size
+        except FileNotFoundError:
+            with self.buffer() as buffer:
+                return len(buffer)
+
+    def text(self) -> str:
+        with self.buffer() as buffer:
+            return buffer[:].decode('utf-8')
+
+    @functools.cached_property
+    def checkpoints(self) -> array.array:
+
+        # the number of line breaks before the start of every chunk,
+        # built on the first lookup and shared by all later ones
+        checkpoints = array.array('Q', [0])
+        with self.buffer() as buffer:
+            for start in range(0, len(buffer), CHUNK_SIZE):
+                checkpoints.append(checkpoints[-1] + buffer[start:start + CHUNK_SIZE].count(b'\n'))
+
+        return checkpoints
+
+    def lines(self, first: int, last: int) -> list[str]:
+
+        # lines first to last, one-based and inclusive, only the
+        # chunks that hold them are read out of the buffer
+        first = max(first, 1)
+        if last < first:
+            return []
+
+        # a chunk may start in the middle of a line, so the one searched
+        # from must have a line break before the first line starts
+        checkpoints = self.checkpoints
+        chunk = max(bisect.bisect_left(checkpoints, first - 1) - 1, 0)
+        end = bisect.bisect_left(checkpoints, last, lo=chunk)
+        with self.buffer() as buffer:
+            region = buffer[chunk * CHUNK_SIZE:min(end * CHUNK_SIZE, len(buffer))]
+
+        skip = first - 1 - checkpoints[chunk]
+        return [
+            line.decode('utf-8', errors='replace')
+            for line in region.split(b'\n')[skip:skip + last - first + 1]
+        ]
+
+    def location(self, line: int, col_start: int, col_end: int, window: int = 0) -> dict:
+
+        # the lines around the failing one are only added on request
+        lines = self.lines(line - window, line + window)
+        offset = line - max(line - window, 1)
+        location = {
+            'colStart': col_start,
+            'colEnd': col_end,
+            'content': lines[offset] if offset < len(lines) else ''
+        }
+
+        if window > 0:
+            location['before'] = lines[:offset]
+            location['after'] = lines[offset + 1:]
+
+        return location
@@ -0,0 +1,66 @@
+from __future__ import annotations
+
+import array
+import struct
+import typing
+import dataclasses
+
+MAGIC: typing.Final[bytes] = b'DHTS'
+
+# magic, number of tokens, lexical error flag
+HEADER: typing.Final[struct.Struct] = struct.Struct('<4sII')
+
+@dataclasses.dataclass(frozen=True, kw_only=True)
+class TokenStream:
+
+    # token ids index the terminals of the scanner that produced the stream,
+    # the arrays are either owned or zero-copy views of a memory mapped file
+    ids: typing.Sequence[int]
+    lines: typing.Sequence[int]
+    col_starts: typing.Sequence[int]
+    col_ends: typing.Sequence[int]
+    lexical_error: bool
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def release(self) -> None:
+
+        # a mapping cannot be closed while views of it are alive
+        for values in (self.ids, self.lines, self.col_starts, self.col_ends):
+            if isinstance(values, memoryview):
+                values.release()
+
+    def to_bytes(self) -> bytes:
+
+        # the wide arrays come first, so every array stays aligned
+        return b''.join([
+            HEADER.pack(MAGIC, len(self.ids), int(self.lexical_error)),
+            array.array('I', self.lines).tobytes(),
+            array.array('I', self.col_starts).tobytes(),
+            array.array('I', self.col_ends).tobytes(),
+            array.array('H', self.ids).tobytes()
+        ])
+
+    @staticmethod
+    def from_buffer(buffer: typing.Any) -> typing.Optional[TokenStream]:
+
+        view = memoryview(buffer)
+        if len(view) < HEADER.size:
+            return None
+
+        magic, count, lexical_error = HEADER.unpack_from(view)
+        if magic != MAGIC or len(view) != HEADER.size + count * 14:
+            return None
+
+        lines = HEADER.size
+        col_starts = lines + count * 4
+        col_ends = col_starts + count * 4
+        ids = col_ends + count * 4
+        return TokenStream(
+            ids=view[ids:ids + count * 2].cast('H'),
+            lines=view[lines:col_starts].cast('I'),
+            col_starts=view[col_starts:col_ends].cast('I'),
+            col_ends=view[col_ends:ids].cast('I'),
+            lexical_error=bool(lexical_error)
+        )
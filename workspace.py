@@ -0,0 +1,183 @@
+from __future__ import annotations
+
+import os
+import time
+import queue
+import shutil
+import typing
+import pathlib
+import logging
+import requests
+import contextlib
+import subprocess
+import dataclasses
+import concurrent.futures
+
+PARSER_PROJECT_DIR: typing.Final[pathlib.Path] = pathlib.Path('dhscanner_ast_parser')
+LEXER_HASKELL_FILENAME: typing.Final[pathlib.Path] = PARSER_PROJECT_DIR / 'Lexer.php.in.hs'
+PARSER_HASKELL_FILENAME: typing.Final[pathlib.Path] = PARSER_PROJECT_DIR / 'Parser.php.in.hs'
+
+# module names of the generated files, as listed in parser.cabal
+ALEX_FILENAME: typing.Final[str] = 'src/PhpLexer.x'
+HAPPY_FILENAME: typing.Final[str] = 'src/PhpParser.y'
+
+BUILD_ROOT: typing.Final[pathlib.Path] = pathlib.Path('.build')
+
+# candidate servers listen next to the
+# main dhscanner parser which uses port 3000
+BASE_PORT: typing.Final[int] = 3100
+
+HEALTHCHECK_TIMEOUT: typing.Final[float] = 60.0
+HEALTHCHECK_INTERVAL: typing.Final[float] = 0.5
+
+# ghc is memory hungry, so only a few candidates compile at once
+POOL_SIZE: typing.Final[int] = 4
+
+class GeneratedFile(typing.Protocol):
+    def store(self, filename: str) -> bool:
+        ...
+
+@dataclasses.dataclass(frozen=True, kw_only=True)
+class Workspace:
+
+    directory: pathlib.Path
+    port: int
+
+    @staticmethod
+    def create(index: int, root: pathlib.Path = BUILD_ROOT) -> Workspace:
+
+        # dist-newstyle of earlier iterations is kept
+        # on purpose, so cabal only rebuilds what changed
+        directory = root / f'candidate_{index}'
+        shutil.copytree(
+            PARSER_PROJECT_DIR,
+            directory,
+            dirs_exist_ok=True,
+            ignore=shutil.ignore_patterns('dist-newstyle')
+        )
+
+        return Workspace(directory=directory, port=BASE_PORT + index)
+
+    @property
+    def url(self) -> str:
+        return f'http://127.0.0.1:{self.port}'
+
+    def generate(self, alex_file: GeneratedFile, happy_file: GeneratedFile) -> None:
+        alex_file.store(str(self.directory / ALEX_FILENAME))
+        happy_file.store(str(self.directory / HAPPY_FILENAME))
+
+    def warm(self) -> None:
+
+        # dependencies go to the shared cabal store once, the
+        # first build then leaves only the parser module to recompile
+        result = subprocess.run(
+            ['cabal', 'build', '--only-dependencies'],
+            cwd=self.directory,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+            text=True,
+            check=False
+        )
+
+        # a cold workspace still builds, just slower,
+        # and the build itself reports what is missing
+        if result.returncode != 0:
+            logging.info('warming %s failed 😬\n%s', self.directory, result.stderr)
+            return
+
+        logging.info('workspace %s is warm 😊', self.directory)
+
+    def build(self) -> typing.Optional[str]:
+
+        result = subprocess.run(
+            ['cabal', 'build'],
+            cwd=self.directory,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True,
+            check=False
+        )
+
+        if result.returncode != 0:
+            logging.info('cabal build failed in %s 😬', self.directory)
+            return result.stderr
+
+        logging.info('cabal build succeeded in %s 😊', self.directory)
+        return None
+
+    def executable(self) -> str:
+
+        result = subprocess.run(
+            ['cabal', 'list-bin', 'parser'],
+            cwd=self.directory,
+            check=True,
+            stdout=subprocess.PIPE,
+            text=True
+        )
+
+        return result.stdout.strip()
+
+    def healthy(self) -> bool:
+
+        deadline = time.monotonic() + HEALTHCHECK_TIMEOUT
+        while time.monotonic() < deadline:
+            try:
+                if requests.get(f'{self.url}/healthcheck', timeout=HEALTHCHECK_INTERVAL).ok:
+                    return True
+            except requests.RequestException:
+                pass
+            time.sleep(HEALTHCHECK_INTERVAL)
+
+        return False
+
+    @contextlib.contextmanager
+    def serve(self) -> typing.Iterator[bool]:
+
+        # the built executable is launched directly, since
+        # terminating cabal run would leave the server running
+        process = subprocess.Popen(
+            [self.executable()],
+            cwd=self.directory,
+            env={ **os.environ, 'PORT': str(self.port) },
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL
+        )
+
+        try:
+            yield self.healthy()
+        finally:
+            process.terminate()
+            process.wait()
+
+@dataclasses.dataclass(frozen=True, kw_only=True)
+class Pool:
+
+    idle: queue.Queue
+
+    @staticmethod
+    def create(size: int = POOL_SIZE, root: pathlib.Path = BUILD_ROOT) -> Pool:
+
+        workspaces = [Workspace.create(slot, root) for slot in range(size)]
+
+        # the first workspace fills the cabal store alone, so the
+        # others find every dependency there and warm up concurrently
+        workspaces[0].warm()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=size) as executor:
+            list(executor.map(Workspace.warm, workspaces[1:]))
+
+        idle: queue.Queue = queue.Queue()
+        for candidate in workspaces:
+            idle.put(candidate)
+
+        return Pool(idle=idle)
+
+    @contextlib.contextmanager
+    def acquire(self) -> typing.Iterator[Workspace]:
+
+        # workspaces are reused across candidates and iterations,
+        # each one serves a single candidate at a time
+        candidate = self.idle.get()
+        try:
+            yield candidate
+        finally:
+            self.idle.put(candidate)